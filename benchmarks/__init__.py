@@ -0,0 +1,12 @@
+"""Benchmarks of pypiw, written for asv (airspeed velocity).
+
+The results are stored per commit in .asv/results, so regressions show up
+by comparing two versions:
+
+    asv run
+    asv continuous master HEAD
+    asv compare master HEAD
+
+Every benchmark class can also be set up and timed by hand, which is what
+benchmarks/parallel.py does when it is run directly.
+"""
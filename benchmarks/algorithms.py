@@ -0,0 +1,94 @@
+"""Benchmarks of the fitness evaluation and the identification."""
+import numpy as np
+from pypiw import algorithms
+from benchmarks.problems import MODELS, problem
+
+
+class Compare(object):
+    """Time the fitness of one individual and of a population."""
+    params = (sorted(MODELS), [100, 1000, 10000])
+    param_names = ['model', 'n_samples']
+
+    def setup(self, name, n_samples):
+        x, y, t, sys = problem(name, n_samples)
+        self.ga = algorithms.Ga(x, y, t, sys, 1, 10, nind=100)
+        self.individual = list(self.ga.pop[0])
+
+    def teardown(self, name, n_samples):
+        self.ga.close()
+
+    def time_compare(self, name, n_samples):
+        algorithms.AlgorithmBase.compare(self.ga, self.individual)
+
+    def time_batch_compare(self, name, n_samples):
+        self.ga.batch_compare(self.ga.pop)
+
+
+class Identify(object):
+    """Time a whole identification and track the fitness it reaches."""
+    params = (sorted(MODELS), [50, 300])
+    param_names = ['model', 'nind']
+    number = 1
+    repeat = 3
+    timeout = 300
+
+    def setup(self, name, nind):
+        self.problem = problem(name)
+
+    def identify(self, nind):
+        """Run ten generations from a fixed seed."""
+        algorithms.seed(0)
+        ga = algorithms.Ga(*self.problem, lower=0, upper=30, nind=nind,
+                           ngen=10)
+        return ga.identify()
+
+    def time_identify(self, name, nind):
+        self.identify(nind)
+
+    def track_fitness(self, name, nind):
+        return self.identify(nind).fitness
+
+    track_fitness.unit = 'std'
+
+
+class EvaluationsToTarget(object):
+    """Track the evaluations Ga and Cma need to reach a target fitness.
+
+    The target is one percent of the standard deviation of the output, and
+    a run that does not reach it reports the evaluation limit.
+    """
+    params = (sorted(MODELS), ['ga', 'cma'])
+    param_names = ['model', 'algorithm']
+    max_evals = 20000
+    timeout = 600
+
+    def setup(self, name, algorithm):
+        self.problem = problem(name)
+        self.target = 0.01*np.std(self.problem[1])
+
+    def track_nevals(self, name, algorithm):
+        algorithms.seed(0)
+        if algorithm == 'ga':
+            alg = algorithms.Ga(*self.problem, lower=0, upper=30, nind=100,
+                                ngen=self.max_evals)
+        else:
+            alg = algorithms.Cma(*self.problem, lower=0, upper=30,
+                                 ngen=self.max_evals)
+        return alg.identify(tol=self.target,
+                            max_evals=self.max_evals).nevals
+
+    track_nevals.unit = 'evaluations'
+
+
+class NonDominatedSort(object):
+    """Time ranking the parents and offspring of NSGA-II."""
+    params = ([200, 2000, 6000], [2, 3])
+    param_names = ['n', 'n_objectives']
+
+    def setup(self, n, n_objectives):
+        self.fitness = np.random.RandomState(0).random_sample(
+            (n, n_objectives))
+
+    def time_non_dominated_ranks(self, n, n_objectives):
+        ranks = algorithms.non_dominated_ranks(self.fitness)
+        algorithms.crowding_distance(self.fitness, ranks)
@@ -0,0 +1,15 @@
+"""Benchmarks of the time it takes to import the modules of pypiw.
+
+Every import runs in a fresh interpreter, which is what a short lived
+worker process pays.
+"""
+
+
+class ImportTime(object):
+    """Time importing each module in a new process."""
+    params = ['pypiw.pypiw', 'pypiw.data', 'pypiw.systems',
+              'pypiw.algorithms', 'pypiw.fleet']
+    param_names = ['module']
+
+    def timeraw_import(self, module):
+        return "import " + module
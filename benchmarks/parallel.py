@@ -0,0 +1,69 @@
+"""Benchmark of the parallel fitness evaluation in Ga.
+
+The benchmark follows the asv conventions, but it can also be run directly
+to print how one generation scales from one to all cores:
+
+    python -m benchmarks.parallel
+"""
+import multiprocessing
+import timeit
+from pypiw import algorithms
+from benchmarks.problems import problem
+
+
+def ieeeg2_problem(n_samples=1000):
+    """Create data and a governor model similar to examples/ieeeg2.py."""
+    return problem('ieeeg2', n_samples)
+
+
+def core_counts():
+    """Number of workers to benchmark, doubling up to all cores."""
+    counts = [1]
+    while counts[-1]*2 <= multiprocessing.cpu_count():
+        counts.append(counts[-1]*2)
+    if counts[-1] != multiprocessing.cpu_count():
+        counts.append(multiprocessing.cpu_count())
+
+    return counts
+
+
+class ParallelEvaluation(object):
+    """Time the evaluation of one generation with several workers."""
+    params = core_counts()
+    param_names = ['n_jobs']
+    timeout = 300
+
+    def setup(self, n_jobs):
+        x, y, t, sys = ieeeg2_problem()
+        self.ga = algorithms.Ga(x, y, t, sys, 0, 50, nind=1000,
+                                n_jobs=n_jobs)
+        # Start the workers before timing
+        self.evaluate()
+
+    def teardown(self, n_jobs):
+        self.ga.close()
+
+    def evaluate(self):
+        """Evaluate the whole population."""
+        return self.ga.toolbox.map(self.ga.toolbox.evaluate, self.ga.pop)
+
+    def time_generation(self, n_jobs):
+        self.evaluate()
+
+
+def main():
+    """Print the time per generation and the speedup for each core count."""
+    bench = ParallelEvaluation()
+    reference = None
+    print("n_jobs  time [s]  speedup")
+    for n_jobs in bench.params:
+        bench.setup(n_jobs)
+        elapsed = min(timeit.repeat(bench.evaluate, number=1, repeat=3))
+        bench.teardown(n_jobs)
+        reference = reference or elapsed
+        print("{:6d}  {:8.3f}  {:7.2f}".format(n_jobs, elapsed,
+                                               reference/elapsed))
+
+
+if __name__ == "__main__":
+    main()
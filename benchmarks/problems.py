@@ -0,0 +1,45 @@
+"""Identification problems shared by the benchmarks.
+
+The models range from the two parameter lead-lag of
+examples/first_order.py over the four parameter governor of
+examples/ieeeg2.py to a six parameter model, so that the benchmarks also
+show how the cost grows with the number of parameters.
+"""
+import numpy as np
+import sympy
+from pypiw import systems
+
+# Model and true parameters of each problem
+MODELS = {
+    'first_order': ("(1+s*T1)/(1+s*T2)", {'T1': 2.0, 'T2': 3.0}),
+    'ieeeg2': ("-K*(1+s*T2)/((1+s*T1)*(1+s*T3))",
+               {'K': 20.0, 'T1': 4.0, 'T2': 2.0, 'T3': 8.0}),
+    'lead_lag2': ("K*(1+s*T1)*(1+s*T3)/((1+s*T2)*(1+s*T4)*(1+s*T5))",
+                  {'K': 2.0, 'T1': 1.0, 'T2': 3.0, 'T3': 0.5, 'T4': 2.0,
+                   'T5': 5.0}),
+}
+
+
+def model(name):
+    """Returns the sympy expression of a model."""
+    return sympy.sympify(MODELS[name][0],
+                         locals={'s': sympy.symbols('s')})
+
+
+def problem(name, n_samples=1000, discretization=None):
+    """Create the data and the system of a problem.
+
+    Args:
+        name: Key of MODELS
+        n_samples: Number of samples, with a time step of 0.05 s
+        discretization: Discretization of the systems.Tf
+
+    Returns:
+        x, y, t and the systems.Tf
+    """
+    sys = systems.Tf(model(name), discretization)
+    t = np.arange(n_samples)*0.05
+    x = np.sin(0.2*t) + (t > 5)
+    y = sys.time_response(MODELS[name][1], x, t)
+
+    return x, y, t, sys
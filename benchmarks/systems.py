@@ -0,0 +1,104 @@
+"""Benchmarks of the system representations."""
+import numpy as np
+from pypiw import systems
+from benchmarks.problems import MODELS, model, problem
+
+
+class TfInit(object):
+    """Time creating a transfer function from its sympy expression."""
+    params = sorted(MODELS)
+    param_names = ['model']
+
+    def setup(self, name):
+        self.sys = model(name)
+        systems.Tf(self.sys)
+
+    def time_init(self, name):
+        systems.Tf(self.sys, cache=False)
+
+    def time_init_cached(self, name):
+        systems.Tf(self.sys)
+
+
+class NumDen(object):
+    """Time evaluating the coefficients of a transfer function."""
+    params = sorted(MODELS)
+    param_names = ['model']
+
+    def setup(self, name):
+        self.sys = systems.Tf(model(name))
+        self.parameters = MODELS[name][1]
+
+    def time_num_den(self, name):
+        self.sys.num_den(self.parameters)
+
+
+class TimeResponse(object):
+    """Time simulating one parameter set."""
+    params = (sorted(MODELS), [100, 1000, 10000], ['none', 'foh'])
+    param_names = ['model', 'n_samples', 'discretization']
+
+    def setup(self, name, n_samples, discretization):
+        self.x, _, self.t, self.sys = problem(
+            name, n_samples, None if discretization == 'none'
+            else discretization)
+        self.parameters = MODELS[name][1]
+
+    def time_time_response(self, name, n_samples, discretization):
+        self.sys.time_response(self.parameters, self.x, self.t)
+
+
+class BatchTimeResponse(object):
+    """Time simulating a population in one batch."""
+    params = (sorted(MODELS), [10, 100, 1000])
+    param_names = ['model', 'nind']
+
+    def setup(self, name, nind):
+        self.x, _, self.t, self.sys = problem(name)
+        self.param_matrix = np.random.RandomState(0).uniform(
+            1, 10, (nind, self.sys.n_atoms))
+
+    def time_batch_time_response(self, name, nind):
+        self.sys.batch_time_response(self.param_matrix, self.x, self.t)
+
+
+class StateSpaceChain(object):
+    """Time simulating a population of a chain of first order lags."""
+    params = ([2, 10, 30], [10, 100])
+    param_names = ['n_states', 'nind']
+
+    def setup(self, n_states, nind):
+        import sympy
+        s = sympy.symbols('s')
+        sys = systems.StateSpace.from_tf(1)
+        for T in sympy.symbols('T0:{}'.format(n_states)):
+            sys = sys.series(1/(1 + s*T))
+        self.sys = sys
+        self.t = np.arange(1000)*0.05
+        self.x = np.sin(0.2*self.t) + (self.t > 5)
+        self.param_matrix = np.random.RandomState(0).uniform(
+            0.1, 1, (nind, n_states))
+
+    def time_batch_time_response(self, n_states, nind):
+        self.sys.batch_time_response(self.param_matrix, self.x, self.t)
+
+
+class NonlinearChain(object):
+    """Time simulating a population of a rate and gate limited governor."""
+    params = [10, 100]
+    param_names = ['nind']
+
+    def setup(self, nind):
+        import sympy
+        from pypiw import nonlinear
+        s, K, T1, T2, T3, R, G = sympy.symbols('s K T1 T2 T3 R Gmax')
+        self.sys = nonlinear.Chain([
+            -K*(1+s*T2)/(1+s*T1), nonlinear.RateLimit(R),
+            nonlinear.Saturation(-G, G), 1/(1+s*T3)])
+        self.t = np.arange(1000)*0.05
+        self.x = 0.1*np.sin(0.2*self.t) + 0.1*(self.t > 5)
+        self.param_matrix = np.random.RandomState(0).uniform(
+            1, 10, (nind, self.sys.n_atoms))
+
+    def time_batch_time_response(self, nind):
+        self.sys.batch_time_response(self.param_matrix, self.x, self.t)
@@ -0,0 +1,2 @@
+"""Power plant identification with genetic algorithms."""
+__version__ = '0.1'
@@ -0,0 +1,20 @@
+"""Asynchronous tracking, kept apart since it needs Python 3.6 syntax."""
+import asyncio
+
+
+async def atrack(identifier, stream):
+    """Follow the parameters through an asynchronous stream of chunks.
+
+    Args:
+        identifier: online.OnlineIdentifier
+        stream: Asynchronous iterable of (in_data, out_data, time) chunks
+
+    Yields:
+        online.Estimate after every update
+    """
+    loop = asyncio.get_event_loop()
+    async for chunk in stream:
+        estimate = await loop.run_in_executor(None, identifier.update,
+                                              *chunk)
+        if estimate is not None:
+            yield estimate
@@ -2,10 +2,87 @@
 Module containing the available algorithms
 """
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict, namedtuple
+import csv
+import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
 import random
+import threading
+import timeit
 import six
-from deap import base, creator, tools, algorithms
 import numpy as np
+from pypiw import data, instrumentation, objectives
+
+
+def seed(value):
+    """Seed the random number generators used by the algorithms."""
+    random.seed(value)
+    np.random.seed(value)
+
+
+# Outcome of an identification run
+IdentificationResult = namedtuple('IdentificationResult',
+                                  'reason ngen nevals fitness elapsed')
+
+
+class FitnessCache(object):
+    """
+    Bounded cache of fitness values with least recently used eviction.
+
+    The parameter vectors are rounded to a number of decimals before they
+    are used as keys, so that individuals that only differ by round off
+    share the same entry.
+    """
+    def __init__(self, maxsize, decimals=10):
+        """
+        Input:
+            maxsize: Maximum number of cached fitness values
+            decimals: Number of decimals the parameters are rounded to
+        """
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def key(self, parameter):
+        """Returns the quantized key of a parameter vector."""
+        return tuple(np.round(np.asarray(parameter, dtype=float),
+                              self.decimals).tolist())
+
+    def get(self, key):
+        """Returns the cached fitness or None, and counts hits and misses."""
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store a fitness value and evict the least recently used ones."""
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Returns a dict with the hit and miss counters."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
 
 
 @six.add_metaclass(ABCMeta)
@@ -13,16 +90,70 @@ class AlgorithmBase():
     """
     Base class for algorithms
     """
-    def __init__(self, in_data, out_data, time, sys, lower, upper):
+    # Shape of the fitness of one individual
+    fitness_shape = ()
+
+    def __init__(self, in_data, out_data, time, sys, lower, upper,
+                 cache_size=0, cache_decimals=10, record_threads=None,
+                 objective=None):
         """
         Constructor for the algorithm base class
+        Input:
+            in_data: Array of in data, or a list of data.Record objects to
+                fit the system to several records at once, or the path of
+                a record saved with data.Record.save. With records out_data
+                and time are not used.
+            out_data: Array of response data
+            time: Time vector
+            sys: The system to identify
+            lower: Lower bounds of the parameters, either one value for all
+                parameters, a dict keyed by sys.atoms_list or a sequence
+                ordered as sys.atoms_list
+            upper: Upper bounds of the parameters, given as lower
+            cache_size: Number of fitness values to cache, 0 disables the
+                cache default=0
+            cache_decimals: Number of decimals the parameters are rounded
+                to before the cache is searched default=10
+            record_threads: Number of threads simulating the records
+                concurrently, by default one per record up to the number
+                of cores
+            objective: objectives.Objective scoring the error, the
+                default objectives.Std is the standard deviation of the
+                error
         """
         self.in_data = in_data
         self.out_data = out_data
         self.time = time
+        self.records = data.as_records(in_data, out_data, time)
+        self.record_threads = record_threads
+        self._threads = None
         self.sys = sys
-        self.lower = lower
-        self.upper = upper
+        self.lower = self._bounds(lower)
+        self.upper = self._bounds(upper)
+        if np.any(self.lower > self.upper):
+            raise ValueError("Lower bounds must not exceed upper bounds")
+        self.cache = (FitnessCache(cache_size, cache_decimals)
+                      if cache_size else None)
+        self.timers = instrumentation.PhaseTimer()
+        self.objective = objective or objectives.Std()
+        self._buffers = threading.local()
+
+    def __getstate__(self):
+        """The error buffers are not sent to worker processes.
+
+        The data are sent as the records only, so that arrays passed to the
+        constructor are not sent next to their converted copies, and
+        records loaded from files are sent as their paths.
+        """
+        state = self.__dict__.copy()
+        del state['_buffers']
+        state.update(in_data=self.records, out_data=None, time=None)
+        return state
+
+    def __setstate__(self, state):
+        """Create new error buffers after unpickling."""
+        self.__dict__.update(state)
+        self._buffers = threading.local()
 
     @abstractmethod
     def identify(self, verbose):
@@ -36,28 +167,432 @@ class AlgorithmBase():
 
     def compare(self, parameter):
         """Method that compares the individuals with the correct value."""
-        return np.std(
-            self.sys.time_response(
-                parameter, self.in_data, self.time) - self.out_data),
+        if self.cache is None:
+            return self._compare(parameter),
+
+        if isinstance(parameter, dict):
+            parameter = [parameter[atom] for atom in self.sys.atoms_list]
+        key = self.cache.key(parameter)
+        fitness = self.cache.get(key)
+        if fitness is None:
+            fitness = self._compare(parameter)
+            self.cache.put(key, fitness)
+
+        return fitness,
+
+    def _compare(self, parameter):
+        """Fitness of one individual."""
+        def loss(record):
+            """Summed loss of the error on one record."""
+            error = self.sys.time_response(
+                parameter, record.in_data, record.time, record.dt)
+            error -= record.out_data
+            return self.objective.totals(error[None], record)[0]
+
+        return self._combine(self._map_records(loss))
+
+    def _combine(self, totals, objective=None):
+        """Combine the summed losses of the records into the fitness.
+
+        Simulations that break down get the worst possible fitness.
+
+        Args:
+            totals: Summed losses of each record
+            objective: Objective the losses are from, self.objective by
+                default
+        """
+        objective = objective or self.objective
+        fitness = objective.fitness(
+            sum(totals), sum(objective.count(rec) for rec in self.records))
+
+        return np.where(np.isnan(fitness), np.inf, fitness)[()]
+
+    def _buffer(self, record, rows, name='error'):
+        """Error buffer of a record with at least the given rows.
+
+        Each thread has its own buffers, which only grow.
+        """
+        buffers = self._buffers.__dict__
+        key = (id(record), name)
+        if key not in buffers or len(buffers[key]) < rows:
+            buffers[key] = np.empty((rows, len(record)))
+
+        return buffers[key][:rows]
+
+    def _map_records(self, func):
+        """Apply func to every record, concurrently if there are several."""
+        if len(self.records) == 1 or self.record_threads == 1:
+            return [func(record) for record in self.records]
+
+        if self._threads is None:
+            self._threads = ThreadPool(
+                self.record_threads or
+                min(len(self.records), multiprocessing.cpu_count()))
+
+        return self._threads.map(func, self.records)
+
+    def residual(self, parameter):
+        """Residual that least squares minimizes in place of the fitness.
+
+        The residual holds the scored samples of the error, transformed
+        and scaled by the objective. With the default objective the mean
+        is removed per record and the sum of squares of the residual is the
+        square of the fitness.
+        """
+        def error(record):
+            """Residual terms of one record."""
+            err = self.sys.time_response(parameter, record.in_data,
+                                         record.time, record.dt)
+            err -= record.out_data
+            return self.objective.residual(err[None], record)[0]
+
+        return (np.concatenate(self._map_records(error)) *
+                self.objective.residual_scale(self._count()))
+
+    def jacobian(self, parameter):
+        """Jacobian of the residual from the analytic sensitivities.
+
+        Requires a system with a sensitivity_response method.
+        """
+        def sensitivity(record):
+            """Residual terms of the sensitivities on one record."""
+            _, sens = self.sys.sensitivity_response(
+                parameter, record.in_data, record.time, record.dt)
+            return self.objective.residual(sens.T, record).T
+
+        return (np.concatenate(self._map_records(sensitivity)) *
+                self.objective.residual_scale(self._count()))
+
+    def _count(self):
+        """Number of scored samples in all the records."""
+        return sum(self.objective.count(record) for record in self.records)
+
+    def refine(self, parameter, jac=None, **kwargs):
+        """Polish a parameter vector with bounded least squares.
+
+        Parameters with equal lower and upper bounds are pinned, they are
+        kept at their bound and left out of the least squares problem.
+
+        Args:
+            parameter: Starting point ordered as sys.atoms_list
+            jac: Jacobian used by scipy.optimize.least_squares. The default
+                is the analytic jacobian if the system provides
+                sensitivities and finite differences otherwise.
+            kwargs: Other arguments to scipy.optimize.least_squares
+
+        Returns:
+            The result of scipy.optimize.least_squares, where x holds the
+            refined parameters
+        """
+        import scipy.optimize
+        x0 = enforce_bounds(np.asarray(parameter, dtype=float),
+                            self.lower, self.upper)
+        if jac is None:
+            jac = (self.jacobian if hasattr(self.sys, 'sensitivity_response')
+                   else '2-point')
+
+        options = self.objective.least_squares_options(self._count())
+        options.update(kwargs)
+
+        free = self.lower < self.upper
+
+        def expand(x):
+            """Full parameter vector from the free parameters."""
+            full = x0.copy()
+            full[free] = x
+            return full
+
+        def residual(x):
+            """Residual of the free parameters."""
+            return self.residual(expand(x))
+
+        def jacobian(x):
+            """Columns of the jacobian of the free parameters."""
+            return jac(expand(x))[:, free]
+
+        result = scipy.optimize.least_squares(
+            residual, x0[free], jac=jacobian if callable(jac) else jac,
+            bounds=(self.lower[free], self.upper[free]), **options)
+        result.x = expand(result.x)
+
+        return result
+
+    def batch_compare(self, parameters):
+        """Method that compares a whole population with the correct value.
+
+        Args:
+            parameters: (N, n_atoms) array with one individual per row
+
+        Returns:
+            Array with the fitness of each individual
+        """
+        return self._cached_batch(parameters, self._batch_compare)
+
+    def _batch_compare(self, parameters):
+        """Fitness of a population."""
+        def loss(record):
+            """Summed loss of the error of each individual on one record."""
+            error = self.sys.batch_time_response(
+                parameters, record.in_data, record.time, record.dt,
+                out=self._buffer(record, len(parameters)))
+            error -= record.out_data
+            return self.objective.totals(error, record)
+
+        return self._combine(self._map_records(loss))
+
+    def _cached_batch(self, parameters, evaluate):
+        """Evaluate the individuals that are not found in the cache.
+
+        Args:
+            parameters: (N, n_atoms) array with one individual per row
+            evaluate: Function returning the fitness of a population
+
+        Returns:
+            Array with the fitness of each individual
+        """
+        parameters = np.asarray(parameters, dtype=float)
+        if self.cache is None:
+            return evaluate(parameters)
+
+        fitness = np.empty((len(parameters),) + self.fitness_shape)
+        missing = OrderedDict()
+        for idx, parameter in enumerate(parameters):
+            key = self.cache.key(parameter)
+            value = self.cache.get(key)
+            if value is None:
+                missing.setdefault(key, []).append(idx)
+            else:
+                fitness[idx] = value
+
+        if missing:
+            # Duplicates within the population are only evaluated once
+            duplicates = sum(map(len, missing.values())) - len(missing)
+            self.cache.hits += duplicates
+            self.cache.misses -= duplicates
+            first = [indices[0] for indices in missing.values()]
+            for (key, indices), value in zip(missing.items(),
+                                             evaluate(parameters[first])):
+                fitness[indices] = value
+                self.cache.put(key, value)
+
+        return fitness
+
+    def cache_info(self):
+        """Returns the hit and miss counters of the fitness cache."""
+        if self.cache is None:
+            return None
+
+        return self.cache.info()
+
+    def profile_info(self):
+        """Returns the counters and timers of the algorithm and the system.
+
+        Returns:
+            dict with the count and total time of each phase of the
+            algorithm, and of the system if it keeps timers. Systems
+            evaluated in worker processes are not counted.
+        """
+        info = {'algorithm': self.timers.info()}
+        if hasattr(self.sys, 'timers'):
+            info['system'] = self.sys.timers.info()
+
+        return info
+
+    def close(self):
+        """Shut down the threads simulating the records."""
+        if self._threads is not None:
+            self._threads.close()
+            self._threads.join()
+            self._threads = None
+
+    def _check_stop(self, tol, stall, stall_tol, std_tol, time_budget,
+                    max_evals, callback):
+        """Check the stopping criteria after a generation.
+
+        The criteria are described in Ga.identify.
+
+        Returns:
+            The name of the criterion that is met, or None
+        """
+        record = self.logbook[-1]
+        if record['min'] < self.best - stall_tol:
+            self.best, self.improved = record['min'], self.gen
+        if callback is not None:
+            with self.timers.phase('callback'):
+                if callback(self, record):
+                    return 'callback'
+
+        if tol is not None and record['min'] <= tol:
+            return 'tol'
+        elif std_tol is not None and record['std'] <= std_tol:
+            return 'std_tol'
+        elif stall is not None and self.gen - self.improved >= stall:
+            return 'stall'
+        elif time_budget is not None and self.elapsed >= time_budget:
+            return 'time_budget'
+        elif max_evals is not None and self.nevals >= max_evals:
+            return 'max_evals'
+        elif self.gen >= self.ngen:
+            return 'ngen'
+
+        return None
+
+    def _record_fitness(self, gen, nevals, fitness, verbose, **extra):
+        """Record the fitness statistics and the timers of a generation.
+
+        Besides the statistics, the record holds the time of the
+        generation, the time of each phase as time_<phase>, and the extra
+        keyword arguments.
+        """
+        timers = {'time_' + name: total - self._phase_totals.get(name, 0.0)
+                  for name, total in self.timers.totals.items()}
+        timers.update(extra)
+        self.logbook.record(gen=gen, nevals=nevals, std=np.std(fitness),
+                            min=np.min(fitness),
+                            time=timeit.default_timer() - self._started,
+                            **timers)
+        self._generation_start()
+        if verbose:
+            print(self.logbook.stream)
+
+    def _generation_start(self):
+        """Mark the start of a generation for the timers in the logbook."""
+        self._started = timeit.default_timer()
+        self._phase_totals = dict(self.timers.totals)
+
+    def log_records(self):
+        """Returns the logbook as a list of dicts, one per generation.
+
+        Phases that did not run in a generation get the time 0, so every
+        record has the same keys.
+        """
+        keys = []
+        for record in self.logbook:
+            keys.extend(key for key in record if key not in keys)
+
+        return [{key: record.get(key, 0.0) for key in keys}
+                for record in self.logbook]
+
+    def save_log(self, path):
+        """Write the logbook to a JSON lines or CSV file.
+
+        The format follows the extension of the file, .jsonl or .csv.
+        """
+        write_records(self.log_records(), path)
+
+    def _refine_hof(self, result):
+        """Refine the individuals in the hall of fame with least squares."""
+        from deap import creator
+        start = timeit.default_timer()
+        nevals = result.nevals
+        refined = []
+        for ind in list(self.hof):
+            solution = self.refine(ind)
+            # Finite difference jacobians cost one simulation per parameter
+            jac_cost = (1 if hasattr(self.sys, 'sensitivity_response')
+                        else len(solution.x))
+            nevals += solution.nfev + (solution.njev or 0)*jac_cost
+            individual = creator.Individual(solution.x.tolist())
+            individual.fitness.values = self.compare(individual)
+            refined.append(individual)
+        self.hof.update(refined)
 
-    def check_bounds(self, min, max):
+        return result._replace(
+            nevals=nevals, fitness=self.hof[0].fitness.values[0],
+            elapsed=result.elapsed + timeit.default_timer() - start)
+
+    def _bounds(self, value):
+        """Returns the bounds as an array ordered as sys.atoms_list."""
+        if isinstance(value, dict):
+            missing = set(self.sys.atoms_list).difference(value)
+            if missing:
+                raise ValueError("No bounds given for {}".format(
+                    ", ".join(sorted(missing))))
+            value = [value[atom] for atom in self.sys.atoms_list]
+
+        bounds = np.array(np.broadcast_to(np.asarray(value, dtype=float),
+                                          (self.sys.n_atoms,)))
+
+        return bounds
+
+    def check_bounds(self, min, max, method='clip'):
         """Check min max for parameter."""
         def decorator(func):
             """Decorator function."""
             def wrapper(*args, **kargs):
                 """Wrapper function."""
                 offspring = func(*args, **kargs)
-                for child in offspring:
-                    for i in range(len(child)):
-                        if child[i] > max:
-                            child[i] = max-0.00001
-                        elif child[i] < min:
-                            child[i] = min+0.00001
+                with self.timers.phase('bounds'):
+                    genes = enforce_bounds(np.array(offspring, dtype=float),
+                                           min, max, method)
+                    for child, row in zip(offspring, genes):
+                        child[:] = row.tolist()
                 return offspring
             return wrapper
         return decorator
 
 
+def write_records(records, path):
+    """Write a list of dicts to a JSON lines or CSV file.
+
+    The format follows the extension of the file, .jsonl or .csv.
+    """
+    if path.endswith('.jsonl'):
+        with open(path, 'w') as log:
+            for record in records:
+                log.write(json.dumps(record) + '\n')
+    elif path.endswith('.csv'):
+        with open(path, 'w') as log:
+            writer = csv.DictWriter(log, list(records[0]) if records
+                                    else [])
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        raise ValueError("Unknown log format " + path)
+
+
+def _replace(source, destination):
+    """Rename a file, replacing the destination if it exists.
+
+    os.rename does not replace existing files on Windows, and os.replace
+    is missing on Python 2, where the destination is removed first.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(source, destination)
+        return
+    if os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+def enforce_bounds(genes, lower, upper, method='clip'):
+    """Moves the genes of a population inside the bounds.
+
+    Args:
+        genes: (N, n_atoms) array with one individual per row
+        lower: Lower bounds, scalar or one per column
+        upper: Upper bounds, scalar or one per column
+        method: 'clip' moves genes outside the bounds to just inside the
+            violated bound. 'reflect' mirrors them in the violated bound.
+
+    Returns:
+        The genes inside the bounds
+    """
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    margin = np.minimum(0.00001, (upper - lower)/2)
+    if method == 'reflect':
+        genes = np.where(genes > upper, 2*upper - genes, genes)
+        genes = np.where(genes < lower, 2*lower - genes, genes)
+    elif method != 'clip':
+        raise ValueError("No such bounds method")
+
+    # Genes still outside, for instance reflected past the other bound, are
+    # clipped.
+    genes = np.where(genes > upper, upper - margin, genes)
+    return np.where(genes < lower, lower + margin, genes)
+
+
 class Ga(AlgorithmBase):
     """
     Class that implements the genetic algorithm presented in DEAP one max
@@ -65,11 +600,16 @@ class Ga(AlgorithmBase):
     """
     def __init__(self, in_data, out_data, time, sys, lower, upper,
                  ngen=40, nind=300, cxpb=0.5, alpha=0.5, mutpb=0.2, mu=0,
-                 sigma=0.1, indpb=0.5, tournsize=3):
+                 sigma=0.1, indpb=0.5, tournsize=3, batch=True, n_jobs=1,
+                 executor=None, cache_size=0, cache_decimals=10,
+                 bounds='clip', compact=False, refine=False, nrefine=1,
+                 record_threads=None, seeds=None, seed_fraction=0.5,
+                 seed_sigma=0.05, objective=None, coarse=None,
+                 coarse_stall=3):
         """
         Initialize the object
         Input:
-            in_data: Array of in data
+            in_data: Array of in data, or a list of data.Record objects
             out_data: Array of response data
             time: Time vector
             sys: Transfer function given as sympy
@@ -82,9 +622,50 @@ class Ga(AlgorithmBase):
             indpb: Probability of mutation of each gene deafult=0.5
             mating: The mating strategy default is blended crossover
             mutation: The mutation strategy the default is gaussian
+            batch: Evaluate each generation in one batched simulation
+                default=True
+            n_jobs: Number of worker processes used to evaluate the
+                population, -1 uses all cores default=1
+            executor: Object with a map method that runs the calls in
+                threads, for instance a thread pool, used to evaluate the
+                population instead of worker processes. The population is
+                then split in n_jobs batches. Process pools are rejected,
+                since they would receive the whole algorithm with every
+                batch, use n_jobs for worker processes instead.
+            cache_size: Number of fitness values to cache default=0
+            cache_decimals: Decimals used to quantize the cache keys
+                default=10
+            bounds: How offspring outside the bounds are handled, 'clip' or
+                'reflect' default='clip'
+            compact: Store the population as one (nind, n_atoms) array with
+                a parallel fitness array, and run selection, crossover and
+                mutation as array operations default=False
+            refine: Polish the best individuals with bounded least squares
+                after the genetic algorithm default=False
+            nrefine: Number of best individuals that are refined default=1
+            record_threads: Number of threads simulating the records
+            seeds: Parameters to start the population from, for instance
+                identified_parameters() of an earlier run. A dict keyed
+                like sys.atoms_list, a parameter list, or a list of those.
+            seed_fraction: Fraction of the initial population made from the
+                seeds, the rest is drawn uniformly default=0.5
+            seed_sigma: Relative standard deviation of the gaussian
+                perturbation of the seeds default=0.05
+            objective: objectives.Objective scoring the error, the standard
+                deviation of the error by default
+            coarse: Score the first generations on the records decimated by
+                this factor, which is faster but less accurate. Weights of
+                objectives.WeightedSse must then be given as a function.
+            coarse_stall: Switch to the full records when the best fitness
+                on the decimated records has not improved for coarse_stall
+                generations, or when a stopping criterion is met
+                default=3
 
         """
-        super(Ga, self).__init__(in_data, out_data, time, sys, lower, upper)
+        from deap import base, creator, tools
+        super(Ga, self).__init__(in_data, out_data, time, sys, lower, upper,
+                                 cache_size, cache_decimals, record_threads,
+                                 objective)
         self.ngen = ngen
         self.nind = nind
         self.cxpb = cxpb
@@ -94,7 +675,29 @@ class Ga(AlgorithmBase):
         self.sigma = sigma
         self.indpb = indpb
         self.tournsize = tournsize
-        self.hof = tools.HallOfFame(1)
+        self.batch = batch
+        self.bounds = bounds
+        self.compact = compact
+        self.refine_best = refine
+        if (coarse is not None and
+                isinstance(self.objective, objectives.WeightedSse) and
+                not callable(self.objective.weights) and
+                np.ndim(self.objective.weights) > 0):
+            raise ValueError("Coarse scoring needs the weights of "
+                             "WeightedSse as a function of time")
+        self.coarse = coarse
+        self.coarse_stall = coarse_stall
+        self.full_records = self.records
+        self.n_jobs = multiprocessing.cpu_count() if n_jobs == -1 else n_jobs
+        if _process_based(executor):
+            raise ValueError("The executor must run in threads, use n_jobs "
+                             "for worker processes")
+        self.executor = executor
+        self.pool = None
+        self.gen = 0
+        self.nevals = 0
+        self.elapsed = 0.0
+        self.hof = tools.HallOfFame(max(nrefine, 1) if refine else 1)
 
         # Make it a minimization problem
         creator.create("FitnessMin", base.Fitness, weights=(-1.0,))
@@ -102,13 +705,11 @@ class Ga(AlgorithmBase):
 
         # Create functions for creating individuals and population
         self.toolbox = base.Toolbox()
-        self.toolbox.register("attr_bool",
-                              random.uniform, self.lower, self.upper)
+        self.toolbox.register("attributes", self.random_parameters)
         self.toolbox.register("individual",
-                              tools.initRepeat,
+                              tools.initIterate,
                               creator.Individual,
-                              self.toolbox.attr_bool,
-                              self.sys.n_atoms)
+                              self.toolbox.attributes)
         self.toolbox.register("population",
                               tools.initRepeat, list, self.toolbox.individual)
 
@@ -118,37 +719,1083 @@ class Ga(AlgorithmBase):
                               sigma=self.sigma, indpb=self.indpb)
 
         self.toolbox.decorate("mate",
-                              self.check_bounds(self.lower, self.upper))
+                              self.check_bounds(self.lower, self.upper,
+                                                self.bounds))
         self.toolbox.decorate("mutate",
-                              self.check_bounds(self.lower, self.upper))
+                              self.check_bounds(self.lower, self.upper,
+                                                self.bounds))
 
         self.toolbox.register("select", tools.selTournament,
                               tournsize=self.tournsize)
 
-        self.pop = self.toolbox.population(n=self.nind)
+        if self.compact:
+            # Individuals that are not evaluated have nan fitness
+            self.pop = np.random.uniform(self.lower, self.upper,
+                                         (self.nind, self.sys.n_atoms))
+            self.fitness = np.full(self.nind, np.nan)
+        else:
+            self.pop = self.toolbox.population(n=self.nind)
+        if seeds is not None:
+            genes, fitness = self._genes()
+            seeded = self.seeded_parameters(
+                seeds, int(round(seed_fraction*self.nind)), seed_sigma)
+            genes[:len(seeded)] = seeded[:self.nind]
+            self._set_genes(genes, np.full(self.nind, np.nan))
         self.toolbox.register("evaluate", self.compare)
+        if self.batch or self.n_jobs > 1 or self.executor is not None:
+            self.toolbox.register("map", self.batch_map)
 
-    def identify(self, algorithm='simple', verbose=False):
+    def random_parameters(self):
+        """Returns a parameter list drawn uniformly within the bounds."""
+        return [random.uniform(low, up)
+                for low, up in zip(self.lower, self.upper)]
+
+    def seeded_parameters(self, seeds, n, sigma=0.05):
+        """Returns parameter sets spread around the given seeds.
+
+        The seeds are used in turn. The first copy of each seed is kept as
+        it is and the others are perturbed by gaussian noise with a
+        standard deviation of sigma times the parameter value, or sigma
+        times the width of the bounds for parameters that are zero.
+
+        Args:
+            seeds: A dict keyed like sys.atoms_list, a parameter list, or a
+                list of those
+            n: Number of parameter sets, at least the number of seeds
+            sigma: Relative standard deviation of the perturbation
+
+        Returns:
+            (n, n_atoms) array of parameter sets within the bounds
         """
-        Function performing the idenfication
+        if isinstance(seeds, dict) or (np.ndim(seeds) == 1 and
+                                       not isinstance(seeds[0], dict)):
+            seeds = [seeds]
+        seeds = np.array([[seed[atom] for atom in self.sys.atoms_list]
+                          if isinstance(seed, dict) else seed
+                          for seed in seeds], dtype=float)
+        n = max(n, len(seeds))
+
+        genes = seeds[np.arange(n) % len(seeds)]
+        scale = np.where(genes != 0, np.abs(genes), self.upper - self.lower)
+        noise = np.random.normal(0, sigma, genes.shape)*scale
+        noise[:len(seeds)] = 0
+
+        return enforce_bounds(genes + noise, self.lower, self.upper,
+                              self.bounds)
+
+    def __getstate__(self):
+        """Only the data and the system are sent to worker processes.
+
+        The record threads can not be pickled, so the worker starts its own
+        when it simulates several records.
+        """
+        state = super(Ga, self).__getstate__()
+        for name in ('toolbox', 'pop', 'fitness', 'hof', 'pool', 'executor',
+                     'cache'):
+            state.pop(name, None)
+        state['_threads'] = None
+        return state
+
+    def batch_map(self, func, individuals):
+        """Map that evaluates all the individuals in one batch.
+
+        With several workers the population is split into one batch per
+        worker. Other functions than toolbox.evaluate are mapped as usual.
         """
-        stats = tools.Statistics(lambda ind: ind.fitness.values)
-        stats.register("std", np.std)
-        stats.register("min", np.min)
-
-        if algorithm == 'simple':
-            self.pop = algorithms.eaSimple(self.pop, self.toolbox,
-                                           cxpb=self.cxpb,
-                                           mutpb=self.mutpb, ngen=self.ngen,
-                                           stats=stats, verbose=verbose,
-                                           halloffame=self.hof)
-        elif algorithm == 'generate':
-            self.pop = algorithms.eaGenerateUpdate(self.toolbox, self.ngen,
-                                                   self.hof)
+        if func is not self.toolbox.evaluate:
+            return map(func, individuals)
+
+        individuals = list(individuals)
+        if not individuals:
+            return []
+
+        return [(fit,) for fit in self._cached_batch(individuals,
+                                                     self._parallel_compare)]
+
+    def _parallel_compare(self, parameters):
+        """Fitness of a population, evaluated by the workers if any."""
+        if self.executor is not None:
+            fitness = self.executor.map(self._batch_compare,
+                                        self._split(parameters))
+        elif self.n_jobs > 1:
+            if self.pool is None:
+                # Forked workers would inherit the record threads without
+                # their threads, so the pool is shut down first.
+                super(Ga, self).close()
+                # The algorithm, and with it the system, is pickled once
+                # per worker instead of once per task.
+                self.pool = multiprocessing.Pool(
+                    self.n_jobs, initializer=_init_worker, initargs=(self,))
+            fitness = self.pool.map(_batch_compare_worker,
+                                    self._split(parameters))
         else:
+            return self._batch_compare(parameters)
+
+        return np.concatenate(list(fitness))
+
+    def _split(self, individuals):
+        """Split the individuals in one chunk per worker."""
+        n_chunks = min(len(individuals), max(self.n_jobs, 1))
+        return np.array_split(np.asarray(individuals, dtype=float), n_chunks)
+
+    def close(self):
+        """Shut down the worker processes."""
+        super(Ga, self).close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def identify(self, algorithm='simple', verbose=False, tol=None,
+                 stall=None, stall_tol=0.0, std_tol=None, time_budget=None,
+                 max_evals=None, checkpoint=None, checkpoint_every=None,
+                 checkpoint_interval=None, resume=None, callback=None):
+        """
+        Function performing the idenfication
+
+        The run stops after ngen generations, or earlier as soon as one of
+        the given convergence criteria is met. The criteria are checked
+        after each generation.
+        Input:
+            algorithm: The evolutionary algorithm, 'simple' or 'generate'
+                which runs the CMA-ES of Cma with the data, bounds and ngen
+                of this object default='simple'
+            verbose: Print the statistics of each generation
+            tol: Stop when the best fitness is at most tol
+            stall: Stop when the best fitness has not improved by more than
+                stall_tol during stall generations
+            stall_tol: Smallest improvement of the best fitness that resets
+                the stall count default=0
+            std_tol: Stop when the standard deviation of the fitness in the
+                population is at most std_tol
+            time_budget: Stop when the run has taken time_budget seconds
+            max_evals: Stop when max_evals fitness evaluations have been
+                used
+            checkpoint: Path of a checkpoint file that is written during
+                the run and when it stops
+            checkpoint_every: Write the checkpoint every checkpoint_every
+                generations, every generation if neither this nor
+                checkpoint_interval is given
+            checkpoint_interval: Write the checkpoint when checkpoint_interval
+                seconds have passed since it was last written
+            resume: Path of a checkpoint to continue the run from. With the
+                same settings the run continues exactly as if it had not
+                been interrupted.
+            callback: Function called as callback(ga, record) after each
+                generation with its logbook record. The run stops when it
+                returns True.
+        Returns:
+            IdentificationResult telling why the run stopped
+        """
+        if algorithm == 'generate':
+            if checkpoint is not None or resume is not None:
+                raise ValueError("Checkpoints are not available with "
+                                 "algorithm='generate'")
+            strategy = Cma(self.records, None, None, self.sys, self.lower,
+                           self.upper, ngen=self.ngen, refine=self.refine_best,
+                           record_threads=self.record_threads,
+                           objective=self.objective)
+            strategy.cache = self.cache
+            self.result = strategy.identify(verbose, tol, stall, stall_tol,
+                                            std_tol, time_budget, max_evals,
+                                            callback)
+            self.hof, self.logbook = strategy.hof, strategy.logbook
+            return self.result
+        elif algorithm != 'simple':
             raise ValueError("No such algorithm")
 
+        if checkpoint is not None and not (checkpoint_every or
+                                           checkpoint_interval):
+            checkpoint_every = 1
+
+        try:
+            self.result = self._evolve(
+                verbose, tol, stall, stall_tol, std_tol, time_budget,
+                max_evals, checkpoint, checkpoint_every, checkpoint_interval,
+                resume, callback)
+        finally:
+            self.close()
+
+        if self.refine_best:
+            with self.timers.phase('refine'):
+                self.result = self._refine_hof(self.result)
+
+        if verbose:
+            print("Stopped after {} generations and {} evaluations: "
+                  "{}".format(self.result.ngen, self.result.nevals,
+                              self.result.reason))
+            if self.cache is not None:
+                print("Fitness cache: {hits} hits, {misses} misses".format(
+                    **self.cache_info()))
+
+        return self.result
+
+    def _evolve(self, verbose, tol, stall, stall_tol, std_tol, time_budget,
+                max_evals, checkpoint, checkpoint_every, checkpoint_interval,
+                resume, callback):
+        """Run generations until a stopping criterion is met.
+
+        The generations follow algorithms.eaSimple with tournament
+        selection, blend crossover and gaussian mutation.
+        """
+        from deap import tools
+        # The time includes the evaluation of the first population, and a
+        # resumed run continues the time of the checkpoint.
+        start = timeit.default_timer()
+        self._generation_start()
+        if resume is not None:
+            self.load_checkpoint(resume)
+            start -= self.elapsed
+        else:
+            self.logbook = tools.Logbook()
+            self.logbook.header = ['gen', 'nevals', 'std', 'min']
+            self.gen = 0
+            self.elapsed = 0.0
+            self._set_coarse(self.coarse is not None)
+            with self.timers.phase('evaluate'):
+                self.nevals = self._evaluate_population()
+            self._record(self.gen, self.nevals, verbose)
+            self.best, self.improved = self.logbook[-1]['min'], self.gen
+        saved_gen, saved_time = self.gen, timeit.default_timer()
+
+        while True:
+            self.elapsed = timeit.default_timer() - start
+            reason = self._check_stop(tol, stall, stall_tol, std_tol,
+                                      time_budget, max_evals, callback)
+            if self.records is not self.full_records and (
+                    reason is not None or
+                    self.gen - self.improved >= self.coarse_stall):
+                # Score the population again on the full records
+                self._set_coarse(False)
+                self.gen += 1
+                with self.timers.phase('evaluate'):
+                    new = self._evaluate_population()
+                self.nevals += new
+                self._record(self.gen, new, verbose)
+                self.best, self.improved = self.logbook[-1]['min'], self.gen
+                continue
+
+            if checkpoint is not None and (
+                    reason is not None or
+                    (checkpoint_every and
+                     self.gen - saved_gen >= checkpoint_every) or
+                    (checkpoint_interval and timeit.default_timer() -
+                     saved_time >= checkpoint_interval)):
+                with self.timers.phase('checkpoint'):
+                    self.save_checkpoint(checkpoint)
+                saved_gen, saved_time = self.gen, timeit.default_timer()
+
+            if reason is not None:
+                return IdentificationResult(
+                    reason=reason, ngen=self.gen, nevals=self.nevals,
+                    fitness=self.hof[0].fitness.values[0],
+                    elapsed=self.elapsed)
+
+            self.gen += 1
+            with self.timers.phase('vary'):
+                self._vary()
+            with self.timers.phase('evaluate'):
+                new = self._evaluate_population()
+            self.nevals += new
+            self._record(self.gen, new, verbose)
+
+    def _set_coarse(self, coarse):
+        """Switch between the decimated and the full records.
+
+        All fitness values are invalidated when the records change, and
+        the worker processes, which hold a copy of the records, are shut
+        down so that new ones are started with the current records.
+        """
+        records = ([record.decimate(self.coarse)
+                    for record in self.full_records] if coarse
+                   else self.full_records)
+        if self.records is records:
+            return
+        self.close()
+        self.records = records
+        if self.cache is not None:
+            self.cache.clear()
+        self.hof.clear()
+        genes, _ = self._genes()
+        self._set_genes(genes, np.full(len(genes), np.nan))
+
+    def _genes(self):
+        """Returns the population and its fitness as arrays."""
+        if self.compact:
+            return self.pop, self.fitness
+
+        return (np.array(self.pop, dtype=float).reshape(-1, self.sys.n_atoms),
+                np.array([ind.fitness.values[0] if ind.fitness.valid
+                          else np.nan for ind in self.pop]))
+
+    def _set_genes(self, genes, fitness):
+        """Replace the population, nan fitness marks unevaluated ones."""
+        from deap import creator
+        if self.compact:
+            self.pop, self.fitness = genes.copy(), fitness.copy()
+            return
+
+        self.pop = []
+        for row, fit in zip(genes, fitness):
+            individual = creator.Individual(row.tolist())
+            if not np.isnan(fit):
+                individual.fitness.values = (fit,)
+            self.pop.append(individual)
+
+    def save_checkpoint(self, path):
+        """Save the state of the run to a compressed numpy file.
+
+        The file holds the population, the hall of fame, the logbook, the
+        generation and evaluation counters and the state of the random
+        number generators. It is first written to a temporary file, so an
+        interrupted save does not destroy the previous checkpoint.
+        """
+        genes, fitness = self._genes()
+        version, internal, gauss = random.getstate()
+        _, keys, pos, has_gauss, cached_gauss = np.random.get_state()
+        state = dict(
+            atoms=np.array(self.sys.atoms_list),
+            genes=genes, fitness=fitness,
+            hof_genes=np.array(self.hof, dtype=float).reshape(
+                -1, self.sys.n_atoms),
+            hof_fitness=np.array([ind.fitness.values[0] for ind in self.hof]),
+            logbook=json.dumps([dict(rec) for rec in self.logbook]),
+            gen=self.gen, nevals=self.nevals, elapsed=self.elapsed,
+            best=self.best, improved=self.improved,
+            random_version=version, random_internal=np.array(internal),
+            random_gauss=np.nan if gauss is None else gauss,
+            np_random_keys=keys, np_random_pos=pos,
+            np_random_has_gauss=has_gauss, np_random_gauss=cached_gauss,
+            coarse=self.records is not self.full_records)
+
+        temp = path + '.tmp'
+        with open(temp, 'wb') as checkpoint:
+            np.savez_compressed(checkpoint, **state)
+        _replace(temp, path)
+
+    def load_checkpoint(self, path):
+        """Restore the state of a run saved by save_checkpoint."""
+        from deap import creator, tools
+        with np.load(path) as state:
+            self._check_atoms(state)
+            self._set_coarse('coarse' in state.files and
+                             bool(state['coarse']))
+            self._set_genes(state['genes'], state['fitness'])
+            self.hof.clear()
+            for row, fit in zip(state['hof_genes'], state['hof_fitness']):
+                individual = creator.Individual(row.tolist())
+                individual.fitness.values = (fit,)
+                self.hof.insert(individual)
+            self.logbook = tools.Logbook()
+            self.logbook.header = ['gen', 'nevals', 'std', 'min']
+            for record in json.loads(str(state['logbook'])):
+                self.logbook.record(**record)
+            self.gen = int(state['gen'])
+            self.nevals = int(state['nevals'])
+            self.elapsed = float(state['elapsed'])
+            self.best = float(state['best'])
+            self.improved = int(state['improved'])
+            gauss = float(state['random_gauss'])
+            random.setstate((int(state['random_version']),
+                             tuple(int(val) for val in
+                                   state['random_internal']),
+                             None if np.isnan(gauss) else gauss))
+            np.random.set_state(('MT19937', state['np_random_keys'],
+                                 int(state['np_random_pos']),
+                                 int(state['np_random_has_gauss']),
+                                 float(state['np_random_gauss'])))
+
+    def warm_start(self, path):
+        """Start the population from the one in a checkpoint.
+
+        Use this to start a new run, for instance on fresh data for the
+        same unit. The best individuals of the checkpoint are kept, and
+        the population is filled up with random individuals if the
+        checkpoint has fewer than nind. All individuals are evaluated
+        again.
+        """
+        with np.load(path) as state:
+            self._check_atoms(state)
+            genes = state['genes'][np.argsort(state['fitness'])][:self.nind]
+        if len(genes) < self.nind:
+            genes = np.vstack([genes] + [self.random_parameters()
+                                         for _ in range(self.nind -
+                                                        len(genes))])
+        self._set_genes(genes, np.full(len(genes), np.nan))
+        self.hof.clear()
+
+    def _check_atoms(self, state):
+        """Check that a checkpoint has the same parameters as the system."""
+        if list(state['atoms']) != self.sys.atoms_list:
+            raise ValueError("The checkpoint has the parameters {}".format(
+                ", ".join(state['atoms'])))
+
+    def _vary(self):
+        """Replace the population by selected, mated and mutated offspring."""
+        from deap import algorithms
+        if self.compact:
+            self._vary_compact()
+        else:
+            offspring = self.toolbox.select(self.pop, len(self.pop))
+            self.pop = algorithms.varAnd(offspring, self.toolbox, self.cxpb,
+                                         self.mutpb)
+
+    def _evaluate_population(self):
+        """Evaluate the individuals without fitness and update the hof.
+
+        Returns:
+            The number of evaluated individuals
+        """
+        if self.compact:
+            return self._evaluate_compact()
+
+        invalid = [ind for ind in self.pop if not ind.fitness.valid]
+        fitnesses = self.toolbox.map(self.toolbox.evaluate, invalid)
+        for ind, fit in zip(invalid, fitnesses):
+            ind.fitness.values = fit
+        self.hof.update(self.pop)
+
+        return len(invalid)
+
+    def _record(self, gen, nevals, verbose):
+        """Record the fitness statistics and the timers of the generation."""
+        if self.compact:
+            fitness = self.fitness
+        else:
+            fitness = [ind.fitness.values[0] for ind in self.pop]
+        self._record_fitness(gen, nevals, fitness, verbose)
+
+    def _vary_compact(self):
+        """Replace the population by selected, mated and mutated offspring."""
+        nind, n_atoms = self.pop.shape
+
+        # Tournament selection
+        contestants = np.random.randint(0, nind, (nind, self.tournsize))
+        winners = contestants[np.arange(nind),
+                              np.argmin(self.fitness[contestants], axis=1)]
+        genes = self.pop[winners]
+        fitness = self.fitness[winners]
+
+        # Blend crossover of the pairs (0, 1), (2, 3), ...
+        first = np.arange(0, nind - 1, 2)
+        first = first[np.random.random(len(first)) < self.cxpb]
+        second = first + 1
+        gamma = ((1 + 2*self.alpha)*np.random.random((len(first), n_atoms)) -
+                 self.alpha)
+        genes[first], genes[second] = (
+            (1 - gamma)*genes[first] + gamma*genes[second],
+            gamma*genes[first] + (1 - gamma)*genes[second])
+        mated = np.concatenate((first, second))
+        with self.timers.phase('bounds'):
+            genes[mated] = enforce_bounds(genes[mated], self.lower,
+                                          self.upper, self.bounds)
+        fitness[mated] = np.nan
+
+        # Gaussian mutation
+        mutants = np.flatnonzero(np.random.random(nind) < self.mutpb)
+        mask = np.random.random((len(mutants), n_atoms)) < self.indpb
+        genes[mutants] += mask*np.random.normal(self.mu, self.sigma,
+                                                (len(mutants), n_atoms))
+        with self.timers.phase('bounds'):
+            genes[mutants] = enforce_bounds(genes[mutants], self.lower,
+                                            self.upper, self.bounds)
+        fitness[mutants] = np.nan
+
+        self.pop, self.fitness = genes, fitness
+
+    def _evaluate_compact(self):
+        """Evaluate the individuals without fitness and update the hof."""
+        from deap import creator
+        invalid = np.flatnonzero(np.isnan(self.fitness))
+        if len(invalid):
+            self.fitness[invalid] = self._cached_batch(self.pop[invalid],
+                                                       self._parallel_compare)
+
+        best = np.argmin(self.fitness)
+        individual = creator.Individual(self.pop[best].tolist())
+        individual.fitness.values = (self.fitness[best],)
+        self.hof.update([individual])
+
+        return len(invalid)
+
     def identified_parameters(self):
         """Return the best identified parameter."""
         return {key: value for (key, value) in zip(self.sys.atoms_list,
                                                    self.hof[0])}
+
+
+class Cma(AlgorithmBase):
+    """
+    Class that implements the covariance matrix adaptation evolution
+    strategy (CMA-ES) of DEAP.
+
+    The strategy searches the parameters scaled to [0, 1] between the
+    bounds, so sigma is relative to the width of the bounds. Samples
+    outside the bounds are evaluated at the nearest point inside, and
+    their fitness is penalized by the squared distance to that point.
+
+    CMA-ES is a local search, so when the step size has collapsed the
+    strategy is restarted from a random point with twice the population
+    (IPOP-CMA-ES).
+    """
+    def __init__(self, in_data, out_data, time, sys, lower, upper,
+                 ngen=100, popsize=None, sigma=0.3, centroid=None,
+                 restarts=4, xtol=1e-4, cache_size=0, cache_decimals=10,
+                 refine=False, record_threads=None, objective=None):
+        """
+        Initialize the object
+        Input:
+            in_data: Array of in data, or a list of data.Record objects
+            out_data: Array of response data
+            time: Time vector
+            sys: Transfer function given as sympy
+            lower: Lower bound of the parameters
+            upper: Upper bound of the parameters
+            ngen: Number of generations default=100
+            popsize: Number of samples per generation, the default of
+                CMA-ES is 4 + 3*log(n_atoms)
+            sigma: Initial step size relative to the width of the bounds
+                default=0.3
+            centroid: Initial mean of the search given like the bounds,
+                the middle of the bounds by default
+            restarts: Number of restarts default=4
+            xtol: Restart when the largest step is below xtol times the
+                width of the bounds default=1e-4
+            cache_size: Number of fitness values to cache default=0
+            cache_decimals: Decimals used to quantize the cache keys
+                default=10
+            refine: Polish the best individual with bounded least squares
+                after the strategy default=False
+            record_threads: Number of threads simulating the records
+            objective: objectives.Objective scoring the error, the standard
+                deviation of the error by default
+        """
+        from deap import base, creator, tools
+        super(Cma, self).__init__(in_data, out_data, time, sys, lower, upper,
+                                  cache_size, cache_decimals, record_threads,
+                                  objective)
+        self.ngen = ngen
+        self.popsize = popsize or 4 + int(3*np.log(self.sys.n_atoms))
+        self.sigma = sigma
+        self.restarts = restarts
+        self.xtol = xtol
+        self.refine_best = refine
+        self.hof = tools.HallOfFame(1)
+
+        creator.create("FitnessMin", base.Fitness, weights=(-1.0,))
+        creator.create("Individual", list, fitness=creator.FitnessMin)
+
+        self.width = self.upper - self.lower
+        self.centroid = (np.full(self.sys.n_atoms, 0.5) if centroid is None
+                         else (self._bounds(centroid) - self.lower) /
+                         np.where(self.width > 0, self.width, 1))
+        self._start()
+
+    def _start(self):
+        """Reset the counters and start the strategy from the centroid."""
+        from deap import cma
+        self.gen = 0
+        self.nevals = 0
+        self.elapsed = 0.0
+        self.nrestarts = 0
+        self.hof.clear()
+        self.strategy = cma.Strategy(centroid=self.centroid.tolist(),
+                                     sigma=self.sigma, lambda_=self.popsize)
+
+    def identify(self, verbose=False, tol=None, stall=None, stall_tol=0.0,
+                 std_tol=None, time_budget=None, max_evals=None,
+                 callback=None):
+        """
+        Function performing the identification
+
+        The stopping criteria are the same as for Ga.identify. Every call
+        starts a new run from the initial centroid.
+
+        Returns:
+            IdentificationResult telling why the run stopped
+        """
+        from deap import tools
+        self._start()
+        self.logbook = tools.Logbook()
+        self.logbook.header = ['gen', 'nevals', 'std', 'min']
+        self.best, self.improved = np.inf, 0
+        self._generation_start()
+        start = timeit.default_timer()
+        try:
+            reason = None
+            while reason is None:
+                self.gen += 1
+                fitness = self._generation()
+                self.nevals += len(fitness)
+                self._record_fitness(self.gen, len(fitness), fitness,
+                                     verbose)
+                self.elapsed = timeit.default_timer() - start
+                reason = self._check_stop(tol, stall, stall_tol, std_tol,
+                                          time_budget, max_evals, callback)
+                if (self.strategy.sigma*self.strategy.diagD[-1] < self.xtol
+                        and self.nrestarts < self.restarts):
+                    self._restart()
+        finally:
+            self.close()
+
+        self.result = IdentificationResult(
+            reason=reason, ngen=self.gen, nevals=self.nevals,
+            fitness=self.hof[0].fitness.values[0], elapsed=self.elapsed)
+        if self.refine_best:
+            with self.timers.phase('refine'):
+                self.result = self._refine_hof(self.result)
+
+        return self.result
+
+    def _restart(self):
+        """Restart the strategy from a random point with a larger
+        population."""
+        from deap import cma
+        self.nrestarts += 1
+        self.strategy = cma.Strategy(
+            centroid=np.random.uniform(0, 1, self.sys.n_atoms).tolist(),
+            sigma=self.sigma,
+            lambda_=self.popsize*2**self.nrestarts)
+
+    def _generation(self):
+        """Sample, evaluate and update the strategy with one generation.
+
+        Returns:
+            The fitness of the samples without penalty
+        """
+        from deap import creator
+        with self.timers.phase('generate'):
+            population = self.strategy.generate(creator.Individual)
+            scaled = np.array(population)
+            inside = enforce_bounds(scaled, 0.0, 1.0)
+            genes = self.lower + inside*self.width
+        with self.timers.phase('evaluate'):
+            fitness = self._cached_batch(genes, self._batch_compare)
+
+        penalty = np.sum((scaled - inside)**2, axis=1)
+        for individual, fit in zip(population, fitness*(1 + penalty) +
+                                   penalty):
+            individual.fitness.values = (fit,)
+        with self.timers.phase('update'):
+            self.strategy.update(population)
+
+        best = np.argmin(fitness)
+        individual = creator.Individual(genes[best].tolist())
+        individual.fitness.values = (fitness[best],)
+        self.hof.update([individual])
+
+        return fitness
+
+    def identified_parameters(self):
+        """Return the best identified parameter."""
+        return {key: value for (key, value) in zip(self.sys.atoms_list,
+                                                   self.hof[0])}
+
+
+def dominance(fitness, chunk=256):
+    """Returns which individuals dominate which, for minimization.
+
+    An individual dominates another when it is no worse in any objective
+    and better in at least one. The comparison is made for blocks of rows
+    at a time to bound the size of the temporary arrays.
+
+    Args:
+        fitness: (N, M) array with the M objectives of each individual
+        chunk: Number of rows compared at a time
+
+    Returns:
+        (N, N) boolean array that is True where row dominates column
+    """
+    fitness = np.asarray(fitness, dtype=float)
+    dominates = np.empty((len(fitness), len(fitness)), dtype=bool)
+    better = np.empty((min(chunk, len(fitness)), len(fitness)), dtype=bool)
+    for start in range(0, len(fitness), chunk):
+        block = dominates[start:start + chunk]
+        strictly = better[:len(block)]
+        block.fill(True)
+        strictly.fill(False)
+        for values in fitness.T:
+            column = values[start:start + chunk, None]
+            block &= column <= values
+            strictly |= column < values
+        block &= strictly
+
+    return dominates
+
+
+def non_dominated_ranks(fitness):
+    """Returns the non-dominated front of each individual.
+
+    The first front, rank 0, holds the individuals that no other
+    individual dominates. Each following front holds the individuals that
+    are only dominated by the earlier fronts.
+
+    Args:
+        fitness: (N, M) array with the M objectives of each individual
+
+    Returns:
+        (N,) integer array with the rank of each individual
+    """
+    dominates = dominance(fitness)
+    count = dominates.sum(axis=0)
+    ranks = np.full(len(count), -1)
+    front = np.flatnonzero(count == 0)
+    rank = 0
+    while len(front):
+        ranks[front] = rank
+        count -= dominates[front].sum(axis=0)
+        count[ranks >= 0] = -1
+        front = np.flatnonzero(count == 0)
+        rank += 1
+
+    return ranks
+
+
+def crowding_distance(fitness, ranks):
+    """Returns the crowding distance of each individual within its front.
+
+    The distance is the sum over the objectives of the distance between
+    the neighbours in the front, relative to the range of the front. The
+    extremes of each objective get an infinite distance.
+
+    Args:
+        fitness: (N, M) array with the M objectives of each individual
+        ranks: (N,) array with the front of each individual
+
+    Returns:
+        (N,) array with the crowding distance
+    """
+    fitness = np.asarray(fitness, dtype=float)
+    distance = np.zeros(len(fitness))
+    for rank in np.unique(ranks):
+        front = np.flatnonzero(ranks == rank)
+        for values in fitness[front].T:
+            order = np.argsort(values, kind='mergesort')
+            distance[front[order[[0, -1]]]] = np.inf
+            span = values[order[-1]] - values[order[0]]
+            if len(front) > 2 and np.isfinite(span) and span > 0:
+                distance[front[order[1:-1]]] += (
+                    values[order[2:]] - values[order[:-2]])/span
+
+    return distance
+
+
+class Nsga2(AlgorithmBase):
+    """
+    Class that implements the multi-objective genetic algorithm NSGA-II.
+
+    Every individual is scored by several objectives, for instance the fit
+    in different time windows, and optionally by its deviation from the
+    nameplate values of the parameters. All the objectives that score the
+    error are computed from the same simulation. The population is ranked
+    by non-dominated sorting and crowding distance, and every
+    non-dominated individual that has been evaluated is kept in a Pareto
+    front archive.
+    """
+    def __init__(self, in_data, out_data, time, sys, lower, upper,
+                 objectives=None, nameplate=None, nameplate_scale=None,
+                 nind=100, ngen=100, cxpb=0.9, eta_c=15.0, eta_m=20.0,
+                 indpb=None, archive_size=None, bounds='clip', cache_size=0,
+                 cache_decimals=10, record_threads=None):
+        """
+        Initialize the object
+        Input:
+            in_data: Array of in data, or a list of data.Record objects
+            out_data: Array of response data
+            time: Time vector
+            sys: The system to identify
+            lower: Lower bound of the parameters
+            upper: Upper bound of the parameters
+            objectives: List of objectives.Objective scoring the error,
+                the default is objectives.Std
+            nameplate: Nameplate values of the parameters given like the
+                bounds. If given, the root mean square of the deviation
+                from them is the last objective.
+            nameplate_scale: Scale of the deviation of each parameter
+                given like the bounds, the magnitude of the nameplate
+                value, or the width of the bounds where it is zero, by
+                default
+            nind: Number of individuals in the population default=100
+            ngen: Number of generations default=100
+            cxpb: Probability that a pair of parents is mated default=0.9
+            eta_c: Distribution index of the simulated binary crossover,
+                larger values give children closer to the parents
+                default=15
+            eta_m: Distribution index of the polynomial mutation
+                default=20
+            indpb: Probability that a gene is mutated, 1/n_atoms by
+                default
+            archive_size: Largest number of individuals in the archive,
+                the most crowded are dropped first. Unlimited by default.
+            bounds: Method used to move genes inside the bounds, see
+                enforce_bounds default='clip'
+            cache_size: Number of fitness values to cache default=0
+            cache_decimals: Decimals used to quantize the cache keys
+                default=10
+            record_threads: Number of threads simulating the records
+        """
+        super(Nsga2, self).__init__(in_data, out_data, time, sys, lower,
+                                    upper, cache_size, cache_decimals,
+                                    record_threads,
+                                    objectives[0] if objectives else None)
+        self.objectives = list(objectives or [self.objective])
+        self.nameplate = (None if nameplate is None else
+                          self._bounds(nameplate))
+        if self.nameplate is not None:
+            self.nameplate_scale = (
+                np.where(self.nameplate != 0, np.abs(self.nameplate),
+                         self.upper - self.lower)
+                if nameplate_scale is None else
+                self._bounds(nameplate_scale))
+        self.names = ['objective_{}'.format(idx)
+                      for idx in range(len(self.objectives))]
+        if self.nameplate is not None:
+            self.names.append('nameplate')
+        self.fitness_shape = (len(self.names),)
+
+        self.nind = nind
+        self.ngen = ngen
+        self.cxpb = cxpb
+        self.eta_c = eta_c
+        self.eta_m = eta_m
+        self.indpb = indpb if indpb is not None else 1.0/self.sys.n_atoms
+        self.archive_size = archive_size
+        self.bounds = bounds
+        self.gen = 0
+        self.nevals = 0
+        self.elapsed = 0.0
+
+        self.pop = np.random.uniform(self.lower, self.upper,
+                                     (nind, self.sys.n_atoms))
+        self.fitness = None
+        self.front = np.empty((0, self.sys.n_atoms))
+        self.front_fitness = np.empty((0, len(self.names)))
+
+    def _batch_compare(self, parameters):
+        """Objectives of a population.
+
+        Returns:
+            (N, n_objectives) array with the objectives of each individual
+        """
+        def losses(record):
+            """Summed losses of each objective on one record."""
+            error = self.sys.batch_time_response(
+                parameters, record.in_data, record.time, record.dt,
+                out=self._buffer(record, len(parameters)))
+            error -= record.out_data
+
+            # The objectives overwrite the error, so all but the last one
+            # score a copy of it.
+            totals = []
+            for objective in self.objectives[:-1]:
+                scratch = self._buffer(record, len(parameters), 'scratch')
+                scratch[:] = error
+                totals.append(objective.totals(scratch, record))
+            totals.append(self.objectives[-1].totals(error, record))
+            return totals
+
+        totals = list(zip(*self._map_records(losses)))
+        fitness = [self._combine(total, objective)
+                   for total, objective in zip(totals, self.objectives)]
+        if self.nameplate is not None:
+            deviation = (parameters - self.nameplate)/self.nameplate_scale
+            fitness.append(np.sqrt(np.mean(deviation**2, axis=1)))
+
+        return np.column_stack(fitness)
+
+    def identify(self, verbose=False, time_budget=None, max_evals=None,
+                 callback=None):
+        """
+        Function performing the identification
+
+        Args:
+            verbose: Print the logbook of each generation
+            time_budget: Stop after this many seconds
+            max_evals: Stop after this many evaluations
+            callback: Function called as callback(algorithm, record) after
+                each generation, the run stops if it returns True
+
+        The min and std of the logbook are those of the first objective,
+        and the logbook also holds the smallest value of each objective
+        and the size of the archive.
+
+        Returns:
+            IdentificationResult telling why the run stopped, where the
+            fitness is the smallest first objective in the archive
+        """
+        from deap import tools
+        self.logbook = tools.Logbook()
+        self.logbook.header = ['gen', 'nevals', 'std', 'min', 'front']
+        self.best, self.improved = np.inf, 0
+        self._generation_start()
+        start = timeit.default_timer()
+        try:
+            if self.fitness is None:
+                with self.timers.phase('evaluate'):
+                    self.fitness = self._cached_batch(self.pop,
+                                                      self._batch_compare)
+                self.nevals += len(self.pop)
+                self._update_front(self.pop, self.fitness)
+                self._rank()
+                self._record_front(self.gen, len(self.pop), verbose)
+
+            reason = None
+            while reason is None:
+                self.gen += 1
+                nevals = self._generation()
+                self.nevals += nevals
+                self._record_front(self.gen, nevals, verbose)
+                self.elapsed = timeit.default_timer() - start
+                reason = self._check_stop(None, None, 0.0, None, time_budget,
+                                          max_evals, callback)
+        finally:
+            self.close()
+
+        self.result = IdentificationResult(
+            reason=reason, ngen=self.gen, nevals=self.nevals,
+            fitness=self.front_fitness[0, 0], elapsed=self.elapsed)
+
+        return self.result
+
+    def _rank(self):
+        """Rank the population by front and crowding distance."""
+        with self.timers.phase('sort'):
+            self.ranks = non_dominated_ranks(self.fitness)
+            self.crowding = crowding_distance(self.fitness, self.ranks)
+
+    def _generation(self):
+        """Create, evaluate and select one generation.
+
+        Returns:
+            The number of evaluated offspring
+        """
+        with self.timers.phase('vary'):
+            offspring = self._vary()
+        with self.timers.phase('evaluate'):
+            fitness = self._cached_batch(offspring, self._batch_compare)
+        self._update_front(offspring, fitness)
+
+        # The best nind of the parents and the offspring survive
+        self.pop = np.concatenate((self.pop, offspring))
+        self.fitness = np.concatenate((self.fitness, fitness))
+        self._rank()
+        survivors = np.lexsort((-self.crowding, self.ranks))[:self.nind]
+        self.pop, self.fitness = self.pop[survivors], self.fitness[survivors]
+        self._rank()
+
+        return len(offspring)
+
+    def _vary(self):
+        """Create offspring by tournaments, crossover and mutation."""
+        nind, n_atoms = self.pop.shape
+
+        # Binary tournaments won by the lower rank, then the larger
+        # crowding distance
+        contestants = np.random.randint(0, nind, (nind, 2))
+        first, second = contestants.T
+        better = ((self.ranks[first] < self.ranks[second]) |
+                  ((self.ranks[first] == self.ranks[second]) &
+                   (self.crowding[first] > self.crowding[second])))
+        genes = self.pop[np.where(better, first, second)]
+
+        # Simulated binary crossover of the pairs (0, 1), (2, 3), ...
+        first = np.arange(0, nind - 1, 2)
+        first = first[np.random.random(len(first)) < self.cxpb]
+        second = first + 1
+        u = np.random.random((len(first), n_atoms))
+        beta = np.where(u <= 0.5, (2*u)**(1/(self.eta_c + 1)),
+                        (1/(2*(1 - u)))**(1/(self.eta_c + 1)))
+        genes[first], genes[second] = (
+            0.5*((1 + beta)*genes[first] + (1 - beta)*genes[second]),
+            0.5*((1 - beta)*genes[first] + (1 + beta)*genes[second]))
+
+        # Polynomial mutation
+        u = np.random.random(genes.shape)
+        delta = np.where(u < 0.5, (2*u)**(1/(self.eta_m + 1)) - 1,
+                         1 - (2*(1 - u))**(1/(self.eta_m + 1)))
+        mask = np.random.random(genes.shape) < self.indpb
+        genes += mask*delta*(self.upper - self.lower)
+
+        with self.timers.phase('bounds'):
+            return enforce_bounds(genes, self.lower, self.upper, self.bounds)
+
+    def _update_front(self, genes, fitness):
+        """Add the non-dominated evaluated individuals to the archive."""
+        with self.timers.phase('archive'):
+            finite = np.all(np.isfinite(fitness), axis=1)
+            genes = np.concatenate((self.front, genes[finite]))
+            fitness = np.concatenate((self.front_fitness, fitness[finite]))
+            _, unique = np.unique(genes, axis=0, return_index=True)
+            genes, fitness = genes[unique], fitness[unique]
+
+            keep = ~dominance(fitness).any(axis=0)
+            genes, fitness = genes[keep], fitness[keep]
+            if (self.archive_size is not None and
+                    len(genes) > self.archive_size):
+                crowding = crowding_distance(fitness, np.zeros(len(genes)))
+                keep = np.argsort(-crowding, kind='mergesort')[
+                    :self.archive_size]
+                genes, fitness = genes[keep], fitness[keep]
+
+            order = np.lexsort(fitness.T[::-1])
+            self.front, self.front_fitness = genes[order], fitness[order]
+
+    def _record_front(self, gen, nevals, verbose):
+        """Record the statistics of the population and the archive."""
+        extra = {'min_' + name: value
+                 for name, value in zip(self.names, self.fitness.min(axis=0))}
+        self._record_fitness(gen, nevals, self.fitness[:, 0], verbose,
+                             front=len(self.front), **extra)
+
+    def pareto_front(self):
+        """Returns the archive as a list of dicts.
+
+        Each dict holds the parameters keyed like sys.atoms_list and the
+        objectives keyed by names, ordered by the first objective.
+        """
+        return [dict(list(zip(self.sys.atoms_list, genes.tolist())) +
+                     list(zip(self.names, fitness.tolist())))
+                for genes, fitness in zip(self.front, self.front_fitness)]
+
+    def save_front(self, path):
+        """Write the archive to a JSON lines or CSV file.
+
+        The format follows the extension of the file, .jsonl or .csv.
+        """
+        write_records(self.pareto_front(), path)
+
+    def identified_parameters(self):
+        """Return the archived parameters with the smallest first
+        objective."""
+        return dict(zip(self.sys.atoms_list, self.front[0].tolist()))
+
+
+def _process_based(executor):
+    """Whether an executor is a known pool of processes."""
+    if isinstance(executor, multiprocessing.pool.Pool):
+        return not isinstance(executor, ThreadPool)
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        return False
+
+    return isinstance(executor, ProcessPoolExecutor)
+
+
+# State of the worker processes used by Ga for parallel evaluation.
+_WORKER = {}
+
+
+def _init_worker(algorithm):
+    """Store the algorithm in the worker process.
+
+    A forked worker gets the record threads of the parent without their
+    threads, so it starts its own when it needs them.
+    """
+    algorithm._threads = None
+    _WORKER['algorithm'] = algorithm
+
+
+def _batch_compare_worker(parameters):
+    """Evaluate a chunk of the population in a worker process."""
+    return _WORKER['algorithm']._batch_compare(parameters)
@@ -0,0 +1,136 @@
+"""Module with the on-disk cache of compiled symbolic models.
+
+Expanding a transfer function in s, differentiating its coefficients and
+lambdifying the results takes seconds for large models. The source code
+that sympy.lambdify generates is therefore stored on disk, keyed by a hash
+of the canonical form of the expression, so that other processes, and
+later runs, only have to execute the stored source.
+
+The cache is kept in the directory given by the PYPIW_CACHE_DIR
+environment variable, or else in pypiw below the user cache directory.
+Setting PYPIW_CACHE_DIR to an empty string disables the cache. The key
+includes the pypiw, sympy and Python versions, so entries written by other
+versions are never used, and clear removes them.
+"""
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import tempfile
+import pypiw
+
+
+def cache_dir():
+    """Returns the cache directory, or None if the cache is disabled."""
+    path = os.environ.get('PYPIW_CACHE_DIR')
+    if path is None:
+        root = (os.environ.get('XDG_CACHE_HOME') or
+                os.path.join(os.path.expanduser('~'), '.cache'))
+        path = os.path.join(root, 'pypiw')
+
+    return path or None
+
+
+def key(kind, expr):
+    """Returns the cache key of a symbolic expression.
+
+    Args:
+        kind: Name of what is compiled from the expression
+        expr: sympy expression
+
+    Returns:
+        Hex digest that identifies the expression and the versions
+    """
+    import sympy
+    canonical = '\n'.join((kind, pypiw.__version__, sympy.__version__,
+                           platform.python_version(), sympy.srepr(expr)))
+
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _entry_path(name):
+    """Path of the file of a cache entry."""
+    return os.path.join(cache_dir(), pypiw.__version__, name + '.json')
+
+
+def load(name):
+    """Returns a cache entry, or None if it is missing or unreadable."""
+    if cache_dir() is None:
+        return None
+    try:
+        with open(_entry_path(name)) as entry:
+            return json.load(entry)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def store(name, entry):
+    """Store a cache entry.
+
+    The entry is written to a temporary file that is then renamed, so that
+    processes storing the same entry concurrently never leave a partly
+    written file. Failing to write the cache is not an error.
+
+    Args:
+        name: Key of the entry
+        entry: JSON serializable entry
+    """
+    if cache_dir() is None:
+        return
+    path = _entry_path(name)
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        handle, temp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        with os.fdopen(handle, 'w') as out:
+            json.dump(entry, out)
+        os.rename(temp, path)
+    except (IOError, OSError):
+        pass
+
+
+def clear(all_versions=False):
+    """Remove the cache entries of other pypiw versions.
+
+    Args:
+        all_versions: Remove the entries of the current version as well
+    """
+    root = cache_dir()
+    if root is None or not os.path.isdir(root):
+        return
+    for version in os.listdir(root):
+        if all_versions or version != pypiw.__version__:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def lambdify(args, expr, source=None, symbols=()):
+    """Lambdify an expression, or rebuild the function from its source.
+
+    Args:
+        args: Arguments of the function as passed to sympy.lambdify
+        expr: Expression as passed to sympy.lambdify
+        source: Source generated by an earlier call, the expression is
+            lambdified if None
+        symbols: Symbols in the expression that are not arguments, which
+            lambdify makes available to the function as sympy objects
+
+    Returns:
+        func: The numeric function
+        source: Its source code
+    """
+    import inspect
+    import sympy
+    if source is None:
+        func = sympy.lambdify(args, expr, "numpy")
+        return func, inspect.getsource(func)
+
+    # The namespace of an empty lambdified function is the namespace the
+    # source was generated for.
+    namespace = dict(sympy.lambdify([], 0, "numpy").__globals__)
+    namespace.update((str(symbol), symbol) for symbol in symbols)
+    exec(compile(source, '<pypiw-cache>', 'exec'), namespace)
+
+    return namespace[re.match(r'\s*def (\w+)', source).group(1)], source
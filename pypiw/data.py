@@ -0,0 +1,166 @@
+"""Module containing the representation of measurement records.
+
+Long recordings are best stored once with Record.save, or converted from
+a raw binary file with convert_binary, and then opened with load_record.
+The file is memory mapped, so the samples are read from disk on demand and
+shared through the page cache by all the processes that open it. A record
+loaded from a file is pickled as its path, so worker processes map the
+same file instead of receiving a copy of the samples.
+"""
+import os
+import numpy as np
+import six
+from pypiw import simulation
+
+
+class Record(object):
+    """
+    A measurement record with input, output and time vectors.
+
+    The vectors are stored as contiguous float64 arrays, and the time step
+    of the time vector is found once when the record is created.
+    """
+    def __init__(self, in_data, out_data, time, dt=None):
+        """
+        Input:
+            in_data: Array of in data
+            out_data: Array of response data
+            time: Time vector
+            dt: Time step of the time vector if it is already known
+        """
+        self.in_data = _as_array(in_data)
+        self.out_data = _as_array(out_data)
+        self.time = _as_array(time)
+        if not len(self.in_data) == len(self.out_data) == len(self.time):
+            raise ValueError("in_data, out_data and time must have the "
+                             "same length")
+        self.dt = simulation.uniform_step(self.time) if dt is None else dt
+        self.path = None
+
+    def __getstate__(self):
+        """A record loaded from a file is pickled as its path."""
+        if self.path is None:
+            return self.__dict__
+        return {'path': self.path, 'dt': self.dt}
+
+    def __setstate__(self, state):
+        """Map the file again if the record was pickled as its path."""
+        if set(state) == {'path', 'dt'}:
+            state = load_record(state['path'], dt=state['dt']).__dict__
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.time)
+
+    def decimate(self, factor):
+        """Returns a record with every factor'th sample.
+
+        The samples are picked without filtering, so the record should be
+        sampled well above the bandwidth of the system.
+        """
+        return Record(self.in_data[::factor], self.out_data[::factor],
+                      self.time[::factor])
+
+    def save(self, path):
+        """Save the record to a .npy file that load_record can map.
+
+        The file holds a (3, len(record)) float64 array with the in data,
+        the response data and the time vector as rows.
+        """
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                        shape=(3, len(self)))
+        for row, values in zip(out, (self.in_data, self.out_data,
+                                     self.time)):
+            row[:] = values
+        out.flush()
+        del out
+
+
+def load_record(path, mmap_mode='r', dt=None):
+    """Returns a record backed by a file saved with Record.save.
+
+    Args:
+        path: Path of the .npy file
+        mmap_mode: Memory map mode passed to numpy.load, None reads the
+            whole file into memory
+        dt: Time step of the record if it is already known
+
+    Returns:
+        Record whose vectors are views of the file
+    """
+    values = np.load(path, mmap_mode=mmap_mode)
+    if values.ndim != 2 or len(values) != 3:
+        raise ValueError("{} does not hold a (3, n) array".format(path))
+    if values.dtype != np.float64 or not values.flags['C_CONTIGUOUS']:
+        raise ValueError("{} must hold a C ordered float64 array, convert "
+                         "it with Record.save".format(path))
+
+    record = Record(values[0], values[1], values[2], dt)
+    if mmap_mode is not None:
+        record.path = os.path.abspath(path)
+    return record
+
+
+def convert_binary(source, path, n_channels, channels=(0, 1, 2),
+                   dtype='<f8', offset=0, chunk_size=2**20):
+    """Convert a raw binary recording to a file that load_record can map.
+
+    The source holds interleaved samples of n_channels channels of the
+    given dtype, as written by most data loggers. It is converted chunk by
+    chunk, so recordings larger than the memory can be converted.
+
+    Args:
+        source: Path of the raw binary file
+        path: Path of the .npy file to write
+        n_channels: Number of channels in each sample of the source
+        channels: Index of the in data, response data and time channels
+        dtype: Data type of the source values
+        offset: Number of header bytes before the first sample
+        chunk_size: Number of samples converted at a time
+
+    Returns:
+        Record backed by the converted file
+    """
+    raw = np.memmap(source, dtype=dtype, mode='r', offset=offset)
+    n_samples = len(raw)//n_channels
+    raw = raw[:n_samples*n_channels].reshape(n_samples, n_channels)
+
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64,
+                                    shape=(3, n_samples))
+    for start in range(0, n_samples, chunk_size):
+        stop = min(start + chunk_size, n_samples)
+        for row, channel in zip(out, channels):
+            row[start:stop] = raw[start:stop, channel]
+    out.flush()
+    del out, raw
+
+    return load_record(path)
+
+
+def as_records(in_data, out_data, time):
+    """Returns a list of records from the arguments of an algorithm.
+
+    Args:
+        in_data: Array of in data, a sequence of Record objects, or the
+            path of a file saved with Record.save, in which case out_data
+            and time are not used
+        out_data: Array of response data
+        time: Time vector
+
+    Returns:
+        List of Record objects
+    """
+    if isinstance(in_data, Record):
+        return [in_data]
+    if isinstance(in_data, six.string_types):
+        return [load_record(in_data)]
+    if (isinstance(in_data, (list, tuple)) and in_data and
+            all(isinstance(record, Record) for record in in_data)):
+        return list(in_data)
+
+    return [Record(in_data, out_data, time)]
+
+
+def _as_array(value):
+    """Convert to a contiguous float64 array without copying if possible."""
+    return np.ascontiguousarray(value, dtype=np.float64)
@@ -0,0 +1,331 @@
+"""Module for identifying many units from a collection of recordings.
+
+Every unit is identified in its own job, and the jobs are spread over a
+pool of worker processes. The results are written to the output as each
+job finishes, and a failing unit is reported without stopping the others.
+
+The module can be used from the command line, for instance:
+
+    python -m pypiw.fleet --model="-K*(1+s*T2)/((1+s*T1)*(1+s*T3))" \\
+        --lower 0 --upper 150 --data recordings/ --output results.jsonl
+"""
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import timeit
+import traceback
+import numpy as np
+from pypiw import algorithms, data, systems
+
+# Columns written for every unit, followed by one column per parameter
+COLUMNS = ['unit', 'status', 'fitness', 'runtime', 'ngen', 'nevals',
+           'reason', 'error']
+
+
+class Job(object):
+    """
+    Identification of one unit.
+    """
+    def __init__(self, unit, paths, model, lower, upper, discretization=None,
+                 columns=('in', 'out', 'time'), ga_options=None,
+                 identify_options=None, seed=None):
+        """
+        Input:
+            unit: Name of the unit
+            paths: CSV files with the recordings of the unit
+            model: Transfer function in s, as a sympy expression or string
+            lower: Lower bounds of the parameters, see algorithms.Ga
+            upper: Upper bounds of the parameters, see algorithms.Ga
+            discretization: Discretization used by the systems.Tf
+            columns: Names of the input, output and time columns
+            ga_options: Other keyword arguments to algorithms.Ga
+            identify_options: Keyword arguments to algorithms.Ga.identify
+            seed: Seed of the random number generators
+        """
+        self.unit = unit
+        self.paths = list(paths)
+        self.model = str(model)
+        self.lower = lower
+        self.upper = upper
+        self.discretization = discretization
+        self.columns = columns
+        self.ga_options = ga_options or {}
+        self.identify_options = identify_options or {}
+        self.seed = seed
+
+    def records(self):
+        """Load the recordings of the unit."""
+        return [load_csv(path, *self.columns) for path in self.paths]
+
+    def run(self):
+        """Identify the unit.
+
+        Returns:
+            dict with the result, where status is 'ok' or 'error'
+        """
+        start = timeit.default_timer()
+        result = {'unit': self.unit}
+        try:
+            if self.seed is not None:
+                algorithms.seed(self.seed)
+            sys = systems.Tf(parse_model(self.model), self.discretization)
+            ga = algorithms.Ga(self.records(), None, None, sys, self.lower,
+                               self.upper, **self.ga_options)
+            outcome = ga.identify(**self.identify_options)
+            result.update(ga.identified_parameters())
+            result.update(status='ok', fitness=outcome.fitness,
+                          ngen=outcome.ngen, nevals=outcome.nevals,
+                          reason=outcome.reason)
+        except Exception:
+            result.update(status='error', error=traceback.format_exc())
+        result['runtime'] = timeit.default_timer() - start
+
+        return result
+
+
+def parse_model(model):
+    """Returns the sympy expression of a model given as a string."""
+    import sympy
+    return sympy.sympify(model, locals={'s': sympy.symbols('s')})
+
+
+def model_parameters(models):
+    """Returns the names of the parameters of several models.
+
+    The names are sorted as systems.Tf.atoms_list. Models that can not be
+    parsed are skipped, their jobs report the error.
+
+    Args:
+        models: Transfer functions in s as strings
+
+    Returns:
+        Sorted list with the union of the parameter names
+    """
+    import sympy
+    names = set()
+    for model in set(models):
+        try:
+            expr = parse_model(model)
+        except Exception:
+            continue
+        names.update(str(atom) for atom in expr.atoms(sympy.Symbol))
+    names.discard('s')
+
+    return sorted(names)
+
+
+def load_csv(path, in_column='in', out_column='out', time_column='time'):
+    """Load a recording from a CSV file with a header row.
+
+    Args:
+        path: Path of the CSV file
+        in_column: Name of the input column
+        out_column: Name of the output column
+        time_column: Name of the time column
+
+    Returns:
+        data.Record with the recording
+    """
+    table = np.genfromtxt(path, delimiter=',', names=True)
+
+    return data.Record(table[in_column], table[out_column],
+                       table[time_column])
+
+
+def discover(directory):
+    """Find the recordings of each unit in a directory.
+
+    Every CSV file directly in the directory is one unit named after the
+    file. Every subdirectory is one unit whose recordings are the CSV
+    files in it.
+
+    Returns:
+        List of (unit, paths) tuples sorted by unit
+    """
+    units = []
+    for path in sorted(os.listdir(directory)):
+        full = os.path.join(directory, path)
+        if os.path.isdir(full):
+            paths = sorted(glob.glob(os.path.join(full, '*.csv')))
+            if paths:
+                units.append((path, paths))
+        elif path.endswith('.csv'):
+            units.append((os.path.splitext(path)[0], [full]))
+
+    return units
+
+
+def read_manifest(path):
+    """Read a manifest CSV with the columns unit and path.
+
+    A unit may appear on several rows to give it several recordings.
+    Relative paths are relative to the manifest.
+
+    Returns:
+        List of (unit, paths) tuples in the order of the manifest
+    """
+    units = {}
+    order = []
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as manifest:
+        for row in csv.DictReader(manifest):
+            if row['unit'] not in units:
+                units[row['unit']] = []
+                order.append(row['unit'])
+            units[row['unit']].append(os.path.join(base, row['path']))
+
+    return [(unit, units[unit]) for unit in order]
+
+
+class ResultWriter(object):
+    """
+    Writes results one by one to a JSON lines, CSV or Parquet file.
+
+    The format follows the extension of the file. Parquet requires pyarrow.
+    """
+    def __init__(self, path, parameters):
+        """
+        Input:
+            path: Output file ending with .jsonl, .csv or .parquet
+            parameters: Names of the parameters
+        """
+        self.path = path
+        self.columns = COLUMNS + list(parameters)
+        self.format = os.path.splitext(path)[1].lstrip('.')
+        if self.format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            self._pyarrow = pyarrow
+            self._writer = pyarrow.parquet.ParquetWriter(
+                path, pyarrow.schema(
+                    [(name, pyarrow.string()) for name in COLUMNS[:2]] +
+                    [(name, pyarrow.float64()) for name in COLUMNS[2:4]] +
+                    [(name, pyarrow.int64()) for name in COLUMNS[4:6]] +
+                    [(name, pyarrow.string()) for name in COLUMNS[6:]] +
+                    [(name, pyarrow.float64()) for name in parameters]))
+        elif self.format in ('jsonl', 'csv'):
+            self._file = open(path, 'w')
+            if self.format == 'csv':
+                self._writer = csv.DictWriter(self._file, self.columns)
+                self._writer.writeheader()
+        else:
+            raise ValueError("Unknown output format " + self.format)
+
+    def write(self, result):
+        """Write the result of one unit."""
+        row = {name: result.get(name) for name in self.columns}
+        if self.format == 'parquet':
+            self._writer.write_table(self._pyarrow.Table.from_pylist(
+                [row], schema=self._writer.schema))
+        elif self.format == 'csv':
+            self._writer.writerow(row)
+            self._file.flush()
+        else:
+            self._file.write(json.dumps(row) + '\n')
+            self._file.flush()
+
+    def close(self):
+        """Close the output file."""
+        if self.format == 'parquet':
+            self._writer.close()
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _run(job):
+    """Run a job in a worker process."""
+    return job.run()
+
+
+def identify_fleet(jobs, output=None, n_jobs=-1, callback=None):
+    """Identify many units in a pool of worker processes.
+
+    Args:
+        jobs: Sequence of Job objects
+        output: Path of the output file, see ResultWriter. It has a column
+            for every parameter of the models of the jobs.
+        n_jobs: Number of worker processes, -1 uses all cores
+        callback: Function called with each result as it finishes
+
+    Returns:
+        List of the results in the order they finished
+    """
+    jobs = list(jobs)
+    n_jobs = multiprocessing.cpu_count() if n_jobs == -1 else n_jobs
+    parameters = model_parameters(job.model for job in jobs)
+    writer = ResultWriter(output, parameters) if output else None
+    results = []
+    pool = multiprocessing.Pool(max(min(n_jobs, len(jobs)), 1))
+    try:
+        for result in pool.imap_unordered(_run, jobs):
+            results.append(result)
+            if writer is not None:
+                writer.write(result)
+            if callback is not None:
+                callback(result)
+    finally:
+        pool.close()
+        pool.join()
+        if writer is not None:
+            writer.close()
+
+    return results
+
+
+def _bounds(value):
+    """Parse bounds given on the command line as a number or JSON."""
+    return json.loads(value)
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description="Identify many units from recordings.")
+    parser.add_argument('--model', required=True,
+                        help="transfer function in s as a sympy expression")
+    parser.add_argument('--lower', required=True, type=_bounds,
+                        help="lower bounds, a number or a JSON object")
+    parser.add_argument('--upper', required=True, type=_bounds,
+                        help="upper bounds, a number or a JSON object")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--data', help="directory with the recordings")
+    source.add_argument('--manifest', help="CSV file with unit and path")
+    parser.add_argument('--output', required=True,
+                        help="result file, .jsonl, .csv or .parquet")
+    parser.add_argument('--jobs', type=int, default=-1,
+                        help="number of worker processes")
+    parser.add_argument('--discretization', default=None,
+                        help="foh, zoh or tustin")
+    parser.add_argument('--ngen', type=int, default=40)
+    parser.add_argument('--nind', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    units = (discover(args.data) if args.data
+             else read_manifest(args.manifest))
+    jobs = [Job(unit, paths, args.model, args.lower, args.upper,
+                args.discretization,
+                ga_options={'ngen': args.ngen, 'nind': args.nind},
+                seed=args.seed)
+            for unit, paths in units]
+
+    def report(result):
+        """Print the progress."""
+        print("{unit}: {status} in {runtime:.1f} s".format(**result))
+
+    results = identify_fleet(jobs, args.output, args.jobs, report)
+
+    return int(any(result['status'] != 'ok' for result in results))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
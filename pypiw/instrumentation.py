@@ -0,0 +1,61 @@
+"""Module with counters and timers for profiling the identification.
+
+The timers are cheap enough to be left on: a phase costs two reads of the
+clock and one uncontended lock.
+"""
+from contextlib import contextmanager
+import threading
+import timeit
+
+
+class PhaseTimer(object):
+    """
+    Counts and accumulates the time spent in named phases.
+
+    Phases may be nested, in which case the time of the inner phase is
+    also part of the time of the outer one. The timer may be shared by
+    threads, but a copy sent to a worker process counts on its own.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, elapsed, count=1):
+        """Add elapsed seconds and count calls to a phase."""
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + count
+            self.totals[name] = self.totals.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def phase(self, name, count=1):
+        """Time the body of a with statement as a phase."""
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.add(name, timeit.default_timer() - start, count)
+
+    def info(self):
+        """Returns the count and the total time in seconds of each phase."""
+        with self._lock:
+            return {name: {'count': self.counts[name],
+                           'time': self.totals[name]}
+                    for name in self.totals}
+
+    def reset(self):
+        """Set all counters and timers to zero."""
+        with self._lock:
+            self.counts.clear()
+            self.totals.clear()
+
+    def __getstate__(self):
+        """Locks can not be pickled, so leave it out."""
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        """Create a new lock after unpickling."""
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
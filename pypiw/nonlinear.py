@@ -0,0 +1,282 @@
+"""Module containing systems with nonlinear blocks.
+
+Governor and exciter models contain limits, rate limits and deadbands
+between their linear parts. A Chain is a series connection of linear
+blocks and such nonlinear blocks, for instance a governor with a rate and
+gate limited servo:
+
+    s, K, T1, T2, T3, R, Gmax = sympy.symbols('s K T1 T2 T3 R Gmax')
+    sys = Chain([-K*(1+s*T2)/(1+s*T1), RateLimit(R),
+                 Saturation(0, Gmax), 1/(1+s*T3)])
+
+The chain is simulated with a fixed time step, where every step runs
+through the blocks for the whole population at once.
+"""
+from abc import ABCMeta, abstractmethod
+import timeit
+import six
+import numpy as np
+from pypiw import cache as pypiw_cache, instrumentation, simulation, systems
+
+
+@six.add_metaclass(ABCMeta)
+class Block():
+    """Base class for static and dynamic nonlinear blocks."""
+    def __init__(self, *parameters):
+        """
+        Input:
+            parameters: Parameters of the block as numbers or sympy
+                expressions in the parameters of the system
+        """
+        self.parameters = parameters
+
+    @abstractmethod
+    def start(self, values, dt):
+        """Returns the function computing the output of one time step.
+
+        The returned function takes the (N,) input of a time step and
+        returns the output, and may overwrite the input with it.
+
+        Args:
+            values: (N,) array with the value of each parameter
+            dt: Time step
+
+        Returns:
+            Function of the input of each time step
+        """
+        pass
+
+
+class Saturation(Block):
+    """Limits the signal to lie between a lower and an upper limit."""
+    def __init__(self, lower, upper):
+        """
+        Input:
+            lower: Lower limit
+            upper: Upper limit
+        """
+        super(Saturation, self).__init__(lower, upper)
+
+    def start(self, values, dt):
+        lower, upper = values
+
+        def step(signal):
+            return np.clip(signal, lower, upper, out=signal)
+
+        return step
+
+
+class Deadband(Block):
+    """
+    Removes the part of the signal that lies within a band around zero.
+
+    The output is zero within the band and the signal minus the band
+    outside, so the output has no jump at the edges of the band.
+    """
+    def __init__(self, width):
+        """
+        Input:
+            width: Half the width of the band
+        """
+        super(Deadband, self).__init__(width)
+
+    def start(self, values, dt):
+        width, = values
+        inside = np.empty(len(width))
+
+        def step(signal):
+            np.clip(signal, -width, width, out=inside)
+            signal -= inside
+            return signal
+
+        return step
+
+
+class RateLimit(Block):
+    """
+    Limits the rate of change of the signal.
+
+    The output follows the input, but changes by at most rate times the
+    time step in each step. It starts in zero.
+    """
+    def __init__(self, rate):
+        """
+        Input:
+            rate: Largest rate of change per second
+        """
+        super(RateLimit, self).__init__(rate)
+
+    def start(self, values, dt):
+        limit = values[0]*dt
+        output = np.zeros(len(limit))
+
+        def step(signal):
+            signal -= output
+            np.clip(signal, -limit, limit, out=signal)
+            np.add(output, signal, out=output)
+            signal[:] = output
+            return signal
+
+        return step
+
+
+class _LinearStep(object):
+    """Time step of a discretized linear block, see simulation.simulate."""
+    def __init__(self, Ad, Bd0, Bd1, C, D):
+        self.Ad, self.Bd0, self.Bd1, self.C, self.D = Ad, Bd0, Bd1, C, D
+        self.state = np.zeros(Bd0.shape)
+        self.next = np.empty(Bd0.shape)
+        self.previous = None
+
+    def __call__(self, signal):
+        # The states start in zero as in simulation.simulate_states
+        if self.previous is None:
+            self.previous = signal.copy()
+        else:
+            np.einsum('kij,kj->ki', self.Ad, self.state, out=self.next)
+            self.next += self.Bd0*self.previous[:, None]
+            self.next += self.Bd1*signal[:, None]
+            self.state, self.next = self.next, self.state
+            self.previous[:] = signal
+
+        return np.einsum('ki,ki->k', self.C, self.state) + self.D*signal
+
+
+class Chain(systems.SystemBase):
+    """
+    Class for a series connection of linear and nonlinear blocks.
+
+    Adjacent linear blocks are joined into one systems.StateSpace. The
+    linear blocks start at rest, as in the other systems. Each linear
+    block is discretized on its own, so the signal between two blocks is
+    only known at the samples, and is interpolated as the discretization
+    assumes.
+    """
+    def __init__(self, blocks, discretization='foh', cache=True):
+        """
+        Input:
+            blocks: Sequence of Block objects, systems.StateSpace objects
+                and transfer functions given as sympy expressions in s,
+                from the input to the output
+            discretization: 'foh', 'zoh' or 'tustin' discretization of
+                the linear blocks, see simulation.discretize. The time
+                vectors must be uniformly sampled.
+            cache: Reuse compiled functions from the on-disk cache, see
+                pypiw.cache
+        """
+        import sympy
+        super(Chain, self).__init__()
+        self.timers = instrumentation.PhaseTimer()
+        if discretization not in simulation.METHODS:
+            raise ValueError("No such discretization method")
+        self.discretization = discretization
+
+        self.stages = []
+        for block in blocks:
+            if not isinstance(block, (Block, systems.StateSpace)):
+                block = systems.StateSpace.from_tf(
+                    sympy.sympify(block), discretization, cache)
+            if (isinstance(block, systems.StateSpace) and self.stages and
+                    isinstance(self.stages[-1], systems.StateSpace)):
+                block = self.stages.pop().series(block)
+            self.stages.append(block)
+
+        expressions = [sympy.sympify(parameter) for stage in self.stages
+                       if isinstance(stage, Block)
+                       for parameter in stage.parameters]
+        self.atoms = set().union(
+            *[expr.free_symbols for expr in expressions] +
+            [stage.atoms for stage in self.stages
+             if isinstance(stage, systems.StateSpace)])
+        self.symbols = sorted(self.atoms, key=str)
+        self.atoms_list = [str(atom) for atom in self.symbols]
+        self.n_atoms = len(self.atoms)
+
+        # Columns of the parameters of each linear block
+        self._columns = [
+            [self.atoms_list.index(atom) for atom in stage.atoms_list]
+            if isinstance(stage, systems.StateSpace) else None
+            for stage in self.stages]
+        self._values, self._source = pypiw_cache.lambdify(
+            self.symbols, expressions)
+
+    def __getstate__(self):
+        """The compiled function can not be pickled, send its source."""
+        state = self.__dict__.copy()
+        del state['_values']
+        return state
+
+    def __setstate__(self, state):
+        """Recreate the compiled function after unpickling."""
+        self.__dict__.update(state)
+        self._values, _ = pypiw_cache.lambdify(self.symbols, None,
+                                               self._source, self.atoms)
+
+    def _start(self, param_matrix, dt):
+        """Returns the time step function of every stage."""
+        values = systems._stack(self._values(*param_matrix.T),
+                                (len(param_matrix),))
+        steps = []
+        for stage, columns in zip(self.stages, self._columns):
+            if isinstance(stage, Block):
+                steps.append(stage.start(values[:len(stage.parameters)], dt))
+                values = values[len(stage.parameters):]
+                continue
+            A, B, C, D = stage.matrices(param_matrix[:, columns])
+            steps.append(_LinearStep(*(simulation.discretize(
+                A, B, dt, self.discretization) + (C, D))))
+
+        return steps
+
+    def time_response(self, parameters, x, t, dt=None):
+        """Method that calculates the time response of the system.
+
+        Args:
+            parameters: Value of the parameters in the system
+            x: Input vector
+            t: Time vector
+            dt: Time step of t if it is known to be uniformly sampled
+
+        Returns:
+            numpy array containing the time response
+        """
+        return self.batch_time_response(
+            [self._parameter_list(parameters)], x, t, dt)[0]
+
+    def batch_time_response(self, param_matrix, x, t, dt=None, out=None):
+        """Calculates the time response for several parameter sets.
+
+        Args:
+            param_matrix: (N, n_atoms) array with one parameter set per row
+            x: Input vector
+            t: Time vector
+            dt: Time step of t if it is known to be uniformly sampled
+            out: Optional (N, len(t)) array the responses are written to
+
+        Returns:
+            (N, len(t)) array with one time response per row
+        """
+        param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+        x = np.asarray(x, dtype=float)
+        if dt is None:
+            dt = simulation.uniform_step(t)
+        if dt is None:
+            raise ValueError("Time values must be equally spaced.")
+
+        start = timeit.default_timer()
+        steps = self._start(param_matrix, dt)
+        middle = timeit.default_timer()
+        self.timers.add('matrices', middle - start, len(param_matrix))
+
+        y = np.empty((len(param_matrix), len(x))) if out is None else out
+        signal = np.empty(len(param_matrix))
+        for k, value in enumerate(x):
+            signal.fill(value)
+            output = signal
+            for step in steps:
+                output = step(output)
+            y[:, k] = output
+        self.timers.add('simulate', timeit.default_timer() - middle,
+                        len(param_matrix))
+
+        return y
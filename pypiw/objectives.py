@@ -0,0 +1,258 @@
+"""Module containing the objectives that score a simulated response.
+
+An objective turns the error between the simulated and the measured
+output into a fitness, where lower is better. The loss of every sample is
+summed per record, and the sums and sample counts of all the records are
+turned into one fitness, so that several records are scored as one long
+record.
+
+The samples that are scored can be limited to time windows, to a mask and
+to every decimate'th sample. The selection is made of slices, so the error
+is scored through views without copying it. The error arrays passed to
+the objectives are buffers that are overwritten.
+"""
+from abc import ABCMeta, abstractmethod
+import six
+import numpy as np
+
+
+@six.add_metaclass(ABCMeta)
+class Objective():
+    """Base class for objectives."""
+    # Loss and scale passed to scipy.optimize.least_squares by refine
+    least_squares_loss = 'linear'
+
+    def __init__(self, windows=None, mask=None, decimate=1):
+        """
+        Input:
+            windows: List of (start, stop) times, only samples within one
+                of the windows are scored
+            mask: Function returning a boolean array for a time vector,
+                only samples where it is True are scored
+            decimate: Score every decimate'th of the selected samples
+        """
+        self.windows = windows
+        self.mask = mask
+        self.decimate = decimate
+        self._slices = {}
+
+    def slices(self, record):
+        """Returns the slices of the samples of a record that are scored."""
+        key = id(record)
+        if self._slices.get(key, (None, None))[1] is not record:
+            selected = np.ones(len(record), dtype=bool)
+            if self.windows is not None:
+                selected[:] = False
+                for start, stop in self.windows:
+                    selected |= (record.time >= start) & (record.time <= stop)
+            if self.mask is not None:
+                selected &= np.asarray(self.mask(record.time), dtype=bool)
+            self._slices[key] = (_runs(selected, self.decimate), record)
+
+        return self._slices[key][0]
+
+    def count(self, record):
+        """Returns the number of scored samples of a record."""
+        return sum(len(range(*sl.indices(len(record))))
+                   for sl in self.slices(record))
+
+    def totals(self, error, record):
+        """Returns the summed loss of each row of the error.
+
+        Args:
+            error: (N, len(record)) error buffer, which is overwritten
+            record: The data.Record the error belongs to
+
+        Returns:
+            (N,) array with the loss summed over the scored samples
+        """
+        total = np.zeros(len(error))
+        for sl in self.slices(record):
+            total += self.loss_sum(error[:, sl], record, sl)
+
+        return total
+
+    @abstractmethod
+    def loss_sum(self, error, record, sl):
+        """Sum the loss of the samples in a view of the error buffer.
+
+        Args:
+            error: (N, k) view of the error, which may be overwritten
+            record: The data.Record the error belongs to
+            sl: The slice of the record the view covers
+
+        Returns:
+            (N,) array with the summed loss of each row
+        """
+        pass
+
+    def fitness(self, total, count):
+        """Returns the fitness from the summed loss and the sample count."""
+        return total/count
+
+    def residual(self, error, record):
+        """Returns the scored samples of the error as least squares terms.
+
+        Args:
+            error: (N, len(record)) error of N responses or sensitivities
+            record: The data.Record the error belongs to
+
+        Returns:
+            (N, count) array of residual terms
+        """
+        return np.concatenate([error[:, sl] for sl in self.slices(record)],
+                              axis=1)
+
+    def residual_scale(self, count):
+        """Scale of the residual so least squares minimizes the fitness."""
+        return 1/np.sqrt(count)
+
+    def least_squares_options(self, count):
+        """Loss options to scipy.optimize.least_squares for the residual."""
+        return {'loss': self.least_squares_loss}
+
+
+class Std(Objective):
+    """
+    Standard deviation of the error, the mean is removed per record.
+
+    This is the default objective, which ignores a constant offset between
+    the simulated and the measured output.
+    """
+    def totals(self, error, record):
+        """Remove the mean of the scored samples, then sum the squares."""
+        slices = self.slices(record)
+        mean = sum(error[:, sl].sum(axis=1) for sl in slices)
+        mean /= self.count(record)
+        for sl in slices:
+            error[:, sl] -= mean[:, None]
+
+        return super(Std, self).totals(error, record)
+
+    def loss_sum(self, error, record, sl):
+        np.square(error, out=error)
+        return error.sum(axis=1)
+
+    def fitness(self, total, count):
+        return np.sqrt(total/count)
+
+    def residual(self, error, record):
+        residual = super(Std, self).residual(error, record)
+        return residual - residual.mean(axis=1)[:, None]
+
+
+class Rmse(Objective):
+    """Root mean square of the error."""
+    def loss_sum(self, error, record, sl):
+        np.square(error, out=error)
+        return error.sum(axis=1)
+
+    def fitness(self, total, count):
+        return np.sqrt(total/count)
+
+
+class WeightedSse(Objective):
+    """Weighted sum of the squared error."""
+    def __init__(self, weights, windows=None, mask=None, decimate=1):
+        """
+        Input:
+            weights: Function returning the weight of each sample for a time
+                vector, or an array with one weight per sample of the
+                record if there is only one record
+            windows: See Objective
+            mask: See Objective
+            decimate: See Objective
+        """
+        super(WeightedSse, self).__init__(windows, mask, decimate)
+        self.weights = weights
+        self._weights = {}
+
+    def _record_weights(self, record):
+        """Weights of the samples of a record."""
+        key = id(record)
+        if self._weights.get(key, (None, None))[1] is not record:
+            weights = (self.weights(record.time) if callable(self.weights)
+                       else self.weights)
+            self._weights[key] = (np.broadcast_to(
+                np.asarray(weights, dtype=float), (len(record),)), record)
+
+        return self._weights[key][0]
+
+    def loss_sum(self, error, record, sl):
+        np.square(error, out=error)
+        error *= self._record_weights(record)[sl]
+        return error.sum(axis=1)
+
+    def fitness(self, total, count):
+        return total
+
+    def residual(self, error, record):
+        return super(WeightedSse, self).residual(
+            error*np.sqrt(self._record_weights(record)), record)
+
+    def residual_scale(self, count):
+        return 1.0
+
+
+class Huber(Objective):
+    """
+    Mean Huber loss of the error.
+
+    The loss is quadratic for errors up to delta and linear beyond, which
+    makes the fit robust to outliers in the measurements.
+    """
+    least_squares_loss = 'huber'
+
+    def __init__(self, delta, windows=None, mask=None, decimate=1):
+        """
+        Input:
+            delta: Error where the loss turns from quadratic to linear
+            windows: See Objective
+            mask: See Objective
+            decimate: See Objective
+        """
+        super(Huber, self).__init__(windows, mask, decimate)
+        self.delta = delta
+
+    def loss_sum(self, error, record, sl):
+        # With c = min(|e|, delta) the loss is c**2/2 + delta*(|e| - c)
+        np.abs(error, out=error)
+        total = self.delta*error.sum(axis=1)
+        np.minimum(error, self.delta, out=error)
+        total -= self.delta*error.sum(axis=1)
+        np.square(error, out=error)
+        total += 0.5*error.sum(axis=1)
+        return total
+
+    def least_squares_options(self, count):
+        return {'loss': self.least_squares_loss,
+                'f_scale': self.delta/np.sqrt(count)}
+
+
+class Cauchy(Huber):
+    """
+    Mean Cauchy loss delta**2/2*log(1 + (e/delta)**2) of the error.
+
+    The loss grows only logarithmically for large errors, so outliers have
+    even less weight than with the Huber loss.
+    """
+    least_squares_loss = 'cauchy'
+
+    def loss_sum(self, error, record, sl):
+        error /= self.delta
+        np.square(error, out=error)
+        np.log1p(error, out=error)
+        return 0.5*self.delta**2*error.sum(axis=1)
+
+
+def _runs(selected, decimate=1):
+    """Slices covering the runs of True in a boolean array.
+
+    Every decimate'th selected sample is kept, counted from the start of
+    each run.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(
+        ([False], selected, [False])).astype(int)))
+
+    return [slice(start, stop, decimate)
+            for start, stop in zip(edges[::2], edges[1::2])]
@@ -0,0 +1,145 @@
+"""Module for tracking parameters from a stream of measurements.
+
+The samples arrive in chunks and are kept in a sliding window of fixed
+length. Every time enough new samples have arrived, the parameters are
+identified on the window by a short genetic algorithm run whose population
+is seeded with the previous estimate, so that slowly drifting parameters
+are followed with a bounded amount of work per update.
+
+For example, with chunks of (in, out, time) arrays from a generator:
+
+    tracker = OnlineIdentifier(sys, lower, upper, window=600)
+    for estimate in tracker.track(chunks):
+        print(estimate.time, estimate.parameters)
+"""
+from collections import namedtuple
+import numpy as np
+from pypiw import algorithms, data
+
+# Parameter estimate of one window
+Estimate = namedtuple('Estimate',
+                      'time parameters fitness ngen nevals elapsed')
+
+
+class OnlineIdentifier(object):
+    """
+    Identifies the parameters on a sliding window of a measurement stream.
+
+    The simulations start from rest, so the window is shifted to start in
+    zero: the first input and output samples of the window are subtracted.
+    This assumes that the plant is close to steady state at the start of
+    the window, and a longer window makes the error from that smaller.
+    """
+    def __init__(self, sys, lower, upper, window, step=None, latency=None,
+                 ga_options=None, identify_options=None):
+        """
+        Input:
+            sys: System to identify, see systems
+            lower: Lower bounds of the parameters, see algorithms.Ga
+            upper: Upper bounds of the parameters, see algorithms.Ga
+            window: Number of samples in the window
+            step: Number of new samples between the updates, every chunk
+                gives an update if None
+            latency: Time budget in seconds of each update
+            ga_options: Other keyword arguments to algorithms.Ga, the
+                default is a small population run for a few generations
+            identify_options: Keyword arguments to algorithms.Ga.identify
+        """
+        self.sys = sys
+        self.lower = lower
+        self.upper = upper
+        self.window = window
+        self.step = step
+        self.latency = latency
+        self.ga_options = dict(ngen=10, nind=50)
+        self.ga_options.update(ga_options or {})
+        self.identify_options = identify_options or {}
+        self.estimate = None
+
+        self._in = np.zeros(window)
+        self._out = np.zeros(window)
+        self._time = np.zeros(window)
+        self._filled = 0
+        self._new = 0
+
+    def update(self, in_data, out_data, time):
+        """Add a chunk of samples and update the estimate if it is due.
+
+        Args:
+            in_data: New input samples
+            out_data: New output samples
+            time: Time of the new samples
+
+        Returns:
+            The new Estimate, or None if the window is not yet full or
+            fewer than step samples have arrived since the last update
+        """
+        chunk = [np.asarray(values, dtype=float)[-self.window:]
+                 for values in (in_data, out_data, time)]
+        size = len(chunk[2])
+        if not size:
+            return None
+        for buffer, values in zip((self._in, self._out, self._time), chunk):
+            if size < self.window:
+                buffer[:-size] = buffer[size:]
+            buffer[-size:] = values
+        self._filled = min(self._filled + size, self.window)
+        self._new += size
+
+        if self._filled < self.window or self._new < (self.step or 1):
+            return None
+        self._new = 0
+
+        return self._identify()
+
+    def _identify(self):
+        """Identify the parameters on the current window."""
+        record = data.Record(self._in - self._in[0],
+                             self._out - self._out[0], self._time)
+        ga_options = dict(self.ga_options)
+        if self.estimate is not None:
+            ga_options.setdefault('seeds', self.estimate.parameters)
+        identify_options = dict(self.identify_options)
+        if self.latency is not None:
+            identify_options.setdefault('time_budget', self.latency)
+
+        ga = algorithms.Ga(record, None, None, self.sys, self.lower,
+                           self.upper, **ga_options)
+        result = ga.identify(**identify_options)
+        self.estimate = Estimate(
+            time=self._time[-1], parameters=ga.identified_parameters(),
+            fitness=result.fitness, ngen=result.ngen, nevals=result.nevals,
+            elapsed=result.elapsed)
+
+        return self.estimate
+
+    def track(self, stream):
+        """Follow the parameters through a stream of chunks.
+
+        Args:
+            stream: Iterable of (in_data, out_data, time) chunks
+
+        Yields:
+            Estimate after every update
+        """
+        for chunk in stream:
+            estimate = self.update(*chunk)
+            if estimate is not None:
+                yield estimate
+
+    def atrack(self, stream):
+        """Follow the parameters through an asynchronous stream of chunks.
+
+        The updates run in the default executor of the event loop, so that
+        the loop keeps serving the stream while the parameters are
+        identified. Use as async for estimate in tracker.atrack(stream).
+
+        Args:
+            stream: Asynchronous iterable of (in_data, out_data, time)
+                chunks
+
+        Returns:
+            Asynchronous iterator of Estimate after every update
+        """
+        from pypiw._online_async import atrack
+        return atrack(self, stream)
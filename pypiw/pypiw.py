@@ -1,7 +1,6 @@
 """
 The main module for PyPiW
 """
-import matplotlib.pyplot as plt
 
 
 class PyPiW(object):
@@ -28,3 +27,23 @@ class PyPiW(object):
         Function to perform the identification
         """
         self.alg.identify()
+
+    def plot(self, ax=None):
+        """
+        Plot the measured response and the response of the identified
+        system. Requires matplotlib, which is installed with the plotting
+        extra: pip install pypiw[plotting]
+        Input:
+            ax: Matplotlib axes to plot in, the current axes by default
+        Returns:
+            The axes
+        """
+        import matplotlib.pyplot as plt
+        ax = ax or plt.gca()
+        response = self.alg.sys.time_response(
+            self.alg.identified_parameters(), self.in_data, self.time)
+        ax.plot(self.time, self.out_data, label='measured')
+        ax.plot(self.time, response, label='identified')
+        ax.legend()
+
+        return ax
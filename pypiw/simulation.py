@@ -0,0 +1,345 @@
+"""Module containing batched simulation kernels for linear systems.
+
+The functions work on stacks of systems, where the first axis runs over
+the individuals of a population, so that a whole population can be
+simulated in one pass.
+"""
+import numpy as np
+import scipy.linalg
+
+# Available discretization methods
+METHODS = ('foh', 'zoh', 'tustin')
+
+
+def uniform_step(t):
+    """Returns the time step of a uniformly sampled time vector.
+
+    Args:
+        t: Time vector
+
+    Returns:
+        The time step, or None if the time vector is not uniformly sampled.
+    """
+    t = np.asarray(t, dtype=float)
+    if len(t) < 2:
+        return None
+    dt = t[1] - t[0]
+    if not np.allclose(np.diff(t), dt):
+        return None
+
+    return dt
+
+
+def canonical_ss(num, den):
+    """Returns controllable canonical state space realizations.
+
+    Args:
+        num: (N, m) array of numerator coefficients, highest power first
+        den: (N, n+1) array of denominator coefficients, highest power
+            first. The leading coefficients must be non-zero and m <= n+1.
+
+    Returns:
+        A: (N, n, n) state matrices
+        B: (n,) input vector, shared by all systems
+        C: (N, n) output vectors
+        D: (N,) feedthrough terms
+    """
+    num = np.atleast_2d(num)
+    den = np.atleast_2d(den)
+    n_sys, order = den.shape[0], den.shape[1] - 1
+
+    a = den[:, 1:]/den[:, :1]
+    b = np.zeros((n_sys, order + 1))
+    b[:, order + 1 - num.shape[1]:] = num/den[:, :1]
+
+    A = np.zeros((n_sys, order, order))
+    A[:, :1, :] = -a[:, None, :]
+    A[:, np.arange(1, order), np.arange(order - 1)] = 1.0
+    B = np.zeros(order)
+    B[:1] = 1.0
+    C = b[:, 1:] - a*b[:, :1]
+    D = b[:, 0]
+
+    return A, B, C, D
+
+
+def _expm(M):
+    """Matrix exponential of each matrix in a (N, n, n) stack.
+
+    scipy.linalg.expm only accepts stacks from SciPy 1.9, so the matrices
+    are exponentiated one at a time.
+    """
+    expM = np.empty_like(M)
+    for matrix, out in zip(M, expM):
+        out[:] = scipy.linalg.expm(matrix)
+
+    return expM
+
+
+def discretize_foh(A, B, dt):
+    """Discretizes state space systems assuming a linearly interpolated input.
+
+    This is the same discretization as used by control.forced_response.
+
+    Args:
+        A: (N, n, n) state matrices
+        B: (n,) or (N, n) input vectors
+        dt: Time step
+
+    Returns:
+        Ad: (N, n, n) discrete state matrices
+        Bd0: (N, n) input vectors acting on the previous input sample
+        Bd1: (N, n) input vectors acting on the current input sample
+    """
+    n_sys, order = A.shape[0], A.shape[1]
+    M = np.zeros((n_sys, order + 2, order + 2))
+    M[:, :order, :order] = A*dt
+    M[:, :order, order] = B*dt
+    M[:, order, order + 1] = 1.0
+    expM = _expm(M)
+    Ad = expM[:, :order, :order]
+    Bd1 = expM[:, :order, order + 1]
+    Bd0 = expM[:, :order, order] - Bd1
+
+    return Ad, Bd0, Bd1
+
+
+def discretize_zoh(A, B, dt):
+    """Discretizes state space systems assuming a piecewise constant input.
+
+    Args:
+        A: (N, n, n) state matrices
+        B: (n,) or (N, n) input vectors
+        dt: Time step
+
+    Returns:
+        Ad: (N, n, n) discrete state matrices
+        Bd0: (N, n) input vectors acting on the previous input sample
+        Bd1: (N, n) zero vectors, the current input sample has no effect
+    """
+    n_sys, order = A.shape[0], A.shape[1]
+    M = np.zeros((n_sys, order + 1, order + 1))
+    M[:, :order, :order] = A*dt
+    M[:, :order, order] = B*dt
+    expM = _expm(M)
+
+    return (expM[:, :order, :order], expM[:, :order, order],
+            np.zeros((n_sys, order)))
+
+
+def discretize_tustin(A, B, dt):
+    """Discretizes state space systems with the bilinear transform.
+
+    Args:
+        A: (N, n, n) state matrices
+        B: (n,) or (N, n) input vectors
+        dt: Time step
+
+    Returns:
+        Ad: (N, n, n) discrete state matrices
+        Bd0: (N, n) input vectors acting on the previous input sample
+        Bd1: (N, n) input vectors acting on the current input sample
+    """
+    n_sys, order = A.shape[0], A.shape[1]
+    eye = np.eye(order)
+    lhs = eye - A*dt/2
+    Ad = np.linalg.solve(lhs, eye + A*dt/2)
+    Bd = np.linalg.solve(lhs, np.broadcast_to(B*dt/2, (n_sys, order))[
+        ..., None])[..., 0]
+
+    return Ad, Bd, Bd
+
+
+def discretize(A, B, dt, method='foh'):
+    """Discretizes state space systems with the given method.
+
+    Args:
+        A: (N, n, n) state matrices
+        B: (n,) or (N, n) input vectors
+        dt: Time step
+        method: 'foh', 'zoh' or 'tustin'
+
+    Returns:
+        Ad, Bd0, Bd1 as used by simulate
+    """
+    if method == 'foh':
+        return discretize_foh(A, B, dt)
+    elif method == 'zoh':
+        return discretize_zoh(A, B, dt)
+    elif method == 'tustin':
+        return discretize_tustin(A, B, dt)
+
+    raise ValueError("No such discretization method")
+
+
+def discrete_response(num, den, u, dt, method='foh'):
+    """Simulates one transfer function as a discrete time filter.
+
+    The transfer function is discretized and the resulting difference
+    equation is run by scipy.signal.lfilter, which avoids the overhead of
+    control.forced_response. The states start at zero, as in
+    control.forced_response. With 'foh' the result equals
+    control.forced_response up to round off. With 'zoh' the input is held
+    constant between the samples, which is exact for piecewise constant
+    inputs and otherwise deviates by O(dt). With 'tustin' the deviation is
+    O(dt**2).
+
+    Args:
+        num: Numerator coefficients, highest power first
+        den: Denominator coefficients, highest power first
+        u: Uniformly sampled input vector
+        dt: Time step
+        method: 'foh', 'zoh' or 'tustin'
+
+    Returns:
+        The output vector
+    """
+    import scipy.signal
+    u = np.asarray(u, dtype=float)
+    A, B, C, D = canonical_ss(num, den)
+    if not A.shape[1]:
+        return D[0]*u
+
+    Ad, Bd0, Bd1 = [mat[0] for mat in discretize(A, B, dt, method)]
+    C, D = C[0], D[0]
+
+    # With x = xd + Bd1 u[k] the recursion becomes a standard discrete
+    # system in xd, which starts in -Bd1 u[0] since x starts at zero.
+    numd, dend = scipy.signal.ss2tf(Ad, (Ad.dot(Bd1) + Bd0)[:, None],
+                                    C[None, :], C.dot(Bd1) + D)
+    state = -Bd1*u[0]
+    free = np.empty(len(dend) - 1)
+    for i in range(len(free)):
+        free[i] = C.dot(state)
+        state = Ad.dot(state)
+    zi = np.convolve(dend, free)[:len(free)]
+
+    y, _ = scipy.signal.lfilter(numd[0], dend, u, zi=zi)
+
+    return y
+
+
+def simulate_states(Ad, Bd0, Bd1, u, out=None):
+    """Propagates the states of a stack of discrete systems.
+
+    The states start at zero and are propagated as
+    x[i] = Ad x[i-1] + Bd0 u[i-1] + Bd1 u[i].
+
+    Args:
+        Ad: (N, n, n) discrete state matrices
+        Bd0: (N, n) input vectors acting on the previous input sample
+        Bd1: (N, n) input vectors acting on the current input sample
+        u: Input vector
+        out: Optional (len(u), N, n) array the states are written to
+
+    Returns:
+        (len(u), N, n) array with the states
+    """
+    u = np.asarray(u, dtype=float)
+    n_sys, order = Ad.shape[0], Ad.shape[1]
+    states = np.empty((len(u), n_sys, order)) if out is None else out
+    states[0] = 0.0
+    for i in range(1, len(u)):
+        states[i] = (np.einsum('kij,kj->ki', Ad, states[i-1]) +
+                     Bd0*u[i-1] + Bd1*u[i])
+
+    return states
+
+
+def simulate(Ad, Bd0, Bd1, C, D, u, out=None, states=None):
+    """Simulates a stack of discrete systems driven by the same input.
+
+    The states are propagated as in simulate_states, but the output is
+    formed at each step, so only the current state and the next step are
+    stored. C is stacked below Ad, so that one product gives both the
+    output and the propagated state.
+
+    Args:
+        Ad: (N, n, n) discrete state matrices
+        Bd0: (N, n) input vectors acting on the previous input sample
+        Bd1: (N, n) input vectors acting on the current input sample
+        C: (N, n) output vectors
+        D: (N,) feedthrough terms
+        u: Input vector
+        out: Optional (N, len(u)) array the output is written to
+        states: Optional work array with N*(2*n + 1) elements
+
+    Returns:
+        (N, len(u)) array with the output of each system
+    """
+    u = np.asarray(u, dtype=float)
+    n_sys, order = Ad.shape[0], Ad.shape[1]
+    if out is None:
+        out = np.empty((n_sys, len(u)))
+    if states is None:
+        states = np.empty(n_sys*(2*order + 1))
+    state = states[:n_sys*order].reshape(n_sys, order)
+    step = states[n_sys*order:].reshape(n_sys, order + 1)
+    AC = np.concatenate((Ad, C[:, None, :]), axis=1)
+    state.fill(0.0)
+    for i in range(len(u)):
+        # step holds Ad x[i] followed by the output C x[i]
+        np.einsum('kij,kj->ki', AC, state, out=step)
+        out[:, i] = step[:, order]
+        if i + 1 < len(u):
+            np.add(step[:, :order], Bd0*u[i], out=state)
+            state += Bd1*u[i+1]
+    for row, feedthrough in zip(out, D):
+        row += feedthrough*u
+
+    return out
+
+
+def sensitivity_ss(num, den, dnum, dden):
+    """Returns a state space system for an output and its sensitivities.
+
+    The controllable canonical realization of num/den is augmented with
+    the derivatives of its states with respect to each parameter. The
+    derivatives of the coefficients are given by dnum and dden.
+
+    Args:
+        num: (m,) numerator coefficients, highest power first
+        den: (n+1,) denominator coefficients with den[0] != 0
+        dnum: (m, p) derivatives of the numerator coefficients
+        dden: (n+1, p) derivatives of the denominator coefficients
+
+    Returns:
+        A: (n*(p+1), n*(p+1)) state matrix
+        B: (n*(p+1),) input vector
+        C: (p+1, n*(p+1)) output matrix, the first row gives the output
+            and the others its derivatives
+        D: (p+1,) feedthrough terms
+    """
+    order, n_par = len(den) - 1, dden.shape[1]
+    num_full = np.zeros(order + 1)
+    num_full[order + 1 - len(num):] = num
+    dnum_full = np.zeros((order + 1, n_par))
+    dnum_full[order + 1 - len(num):] = dnum
+
+    # Derivatives of the normalized coefficients
+    a = den[1:]/den[0]
+    b = num_full/den[0]
+    da = (dden[1:]*den[0] - np.outer(den[1:], dden[0]))/den[0]**2
+    db = (dnum_full*den[0] - np.outer(num_full, dden[0]))/den[0]**2
+
+    A0, B0, C0, D0 = canonical_ss(num, den)
+    A0, C0, D0 = A0[0], C0[0], D0[0]
+    size = order*(n_par + 1)
+    A = np.zeros((size, size))
+    B = np.zeros(size)
+    C = np.zeros((n_par + 1, size))
+    D = np.zeros(n_par + 1)
+    A[:order, :order] = A0
+    B[:order] = B0
+    C[0, :order] = C0
+    D[0] = D0
+    for k in range(n_par):
+        D[k + 1] = db[0, k]
+        if order:
+            block = slice(order*(k + 1), order*(k + 2))
+            A[block, block] = A0
+            A[order*(k + 1), :order] = -da[:, k]
+            C[k + 1, :order] = db[1:, k] - da[:, k]*b[0] - a*db[0, k]
+            C[k + 1, block] = C0
+
+    return A, B, C, D
@@ -1,10 +1,16 @@
-"""Module containing the different system representations."""
+"""Module containing the different system representations.
+
+sympy and control take long to import, so they are imported by the
+methods that need them. Importing the module is then cheap, which matters
+for short lived worker processes.
+"""
 
 from abc import ABCMeta, abstractmethod
+import threading
+import timeit
 import six
-import sympy
-import control
 import numpy as np
+from pypiw import cache as pypiw_cache, instrumentation, simulation
 
 
 @six.add_metaclass(ABCMeta)
@@ -15,28 +21,200 @@ class SystemBase():
         pass
 
     @abstractmethod
-    def time_response(self, parameters, x, t):
-        """This method calculates the time response of the system."""
+    def time_response(self, parameters, x, t, dt=None):
+        """This method calculates the time response of the system.
+
+        dt is the time step of t when it is known to be uniformly sampled,
+        which saves checking the time vector again.
+        """
         pass
 
+    def batch_time_response(self, param_matrix, x, t, dt=None, out=None):
+        """Calculates the time response for several parameter sets.
+
+        Args:
+            param_matrix: (N, n_atoms) array with one parameter set per row
+            x: Input vector
+            t: Time vector
+            dt: Time step of t if it is known to be uniformly sampled
+            out: Optional (N, len(t)) array the responses are written to
+
+        Returns:
+            (N, len(t)) array with one time response per row
+        """
+        if out is None:
+            out = np.empty((len(param_matrix), len(t)))
+        for row, parameters in zip(out, param_matrix):
+            row[:] = self.time_response(parameters, x, t, dt)
+
+        return out
+
+    def _work(self, shape, name='work'):
+        """Returns a work array of the given shape for the current thread.
+
+        The array is zeroed when it is created, and reused as long as the
+        shape does not change. Requires a threading.local in self._local.
+        """
+        work = getattr(self._local, name, None)
+        if work is None or work.shape != shape:
+            work = np.zeros(shape)
+            setattr(self._local, name, work)
+
+        return work
+
+    def _parameter_list(self, parameters):
+        """Order the parameters as atoms_list if they are given as a dict."""
+        if isinstance(parameters, dict):
+            return [parameters[atom] for atom in self.atoms_list]
+
+        return parameters
+
 
 class Tf(SystemBase):
     """Class for transfer function representation."""
-    def __init__(self, sys):
+    def __init__(self, sys, discretization=None, cache=True):
+        """
+        Input:
+            sys: Transfer function given as a sympy expression in s
+            discretization: None simulates with control.forced_response.
+                'foh', 'zoh' or 'tustin' simulates uniformly sampled data
+                as a discrete filter discretized with that method, see
+                simulation.discrete_response for the accuracy of each.
+                Non-uniform time vectors always use forced_response.
+            cache: Reuse the numeric functions compiled for the same
+                expression from the on-disk cache, see pypiw.cache
+
+        The time spent evaluating coefficients and simulating is counted
+        in the instrumentation.PhaseTimer timers.
+        """
+        import sympy
         super(Tf, self).__init__()
+        self.timers = instrumentation.PhaseTimer()
+        self._local = threading.local()
+        if discretization not in (None,) + tuple(simulation.METHODS):
+            raise ValueError("No such discretization method")
+        self.discretization = discretization
         self.sys = sys
         s = sympy.symbols('s')
-        num = sympy.degree(sympy.numer(sys), s)
 
-        den = sympy.degree(sympy.denom(sys), s)
+        self.atoms = self.sys.atoms(sympy.Symbol).difference({s})
+        self.symbols = sorted(self.atoms, key=str)
+        self.atoms_list = [str(atom) for atom in self.symbols]
+        self.n_atoms = len(self.atoms)
+
+        # Only proper systems are stored, so a cached entry has passed the
+        # properness check.
+        self._expansion = None
+        key = pypiw_cache.key('Tf', self.sys) if cache else None
+        entry = pypiw_cache.load(key) if cache else None
+        if entry is None:
+            self._expand()
+            self._sources = self._compile()
+            if cache:
+                pypiw_cache.store(key, {'atoms_list': self.atoms_list,
+                                        'sources': self._sources})
+        else:
+            self._sources = self._compile(entry['sources'])
 
-        if den < num:
+    def _expand(self):
+        """Expand the numerator and denominator in s.
+
+        The expansion is only needed to compile the numeric functions, so
+        it is skipped when they come from the cache, and made on first use
+        of the symbolic coefficients.
+        """
+        import sympy
+        if self._expansion is not None:
+            return self._expansion
+        s = sympy.symbols('s')
+        num, den = sympy.fraction(sympy.together(self.sys))
+
+        if sympy.degree(den, s) < sympy.degree(num, s):
             raise ValueError("System is not proper")
 
-        self.atoms = self.sys.atoms(sympy.Symbol).difference({s})
-        self.atoms_list = [str(atom) for atom in self.atoms]
-        self.n_atoms = len(self.atoms)
-        self.f = sympy.lambdify(self.atoms, self.sys, "numpy")
+        # Expand the numerator and denominator in s once, so that only the
+        # coefficients have to be evaluated for each parameter set.
+        num_coeffs = sympy.Poly(num, s).all_coeffs()
+        den_coeffs = sympy.Poly(den, s).all_coeffs()
+
+        # Derivatives of the coefficients with respect to each parameter
+        self._expansion = {
+            'num_coeffs': num_coeffs, 'den_coeffs': den_coeffs,
+            'num_grads': [[sympy.diff(coeff, par) for par in self.symbols]
+                          for coeff in num_coeffs],
+            'den_grads': [[sympy.diff(coeff, par) for par in self.symbols]
+                          for coeff in den_coeffs]}
+
+        return self._expansion
+
+    @property
+    def num_coeffs(self):
+        """Numerator coefficients in s, highest power first."""
+        return self._expand()['num_coeffs']
+
+    @property
+    def den_coeffs(self):
+        """Denominator coefficients in s, highest power first."""
+        return self._expand()['den_coeffs']
+
+    @property
+    def num_grads(self):
+        """Derivatives of the numerator coefficients to each parameter."""
+        return self._expand()['num_grads']
+
+    @property
+    def den_grads(self):
+        """Derivatives of the denominator coefficients to each parameter."""
+        return self._expand()['den_grads']
+
+    def _compile(self, sources=None):
+        """Create the numeric functions from the symbolic expressions.
+
+        Args:
+            sources: Source code of the functions from an earlier
+                compilation, which is executed instead of lambdifying
+
+        Returns:
+            Dict with the source code of each function
+        """
+        import sympy
+        if sources is None:
+            expressions = {
+                'f': self.sys,
+                '_coeffs': [self.num_coeffs, self.den_coeffs],
+                '_grads': [self.num_grads, self.den_grads]}
+            sources = {}
+            for name, expr in expressions.items():
+                func, sources[name] = pypiw_cache.lambdify(self.symbols, expr)
+                setattr(self, name, func)
+        else:
+            symbols = self.sys.atoms(sympy.Symbol)
+            for name, source in sources.items():
+                func, _ = pypiw_cache.lambdify(self.symbols, None, source,
+                                               symbols)
+                setattr(self, name, func)
+
+        return sources
+
+    def __getstate__(self):
+        """The lambdified functions can not be pickled, so leave them out.
+
+        Their source code is sent instead, and the symbolic expansion is
+        left out as it is only made when it is needed.
+        """
+        state = self.__dict__.copy()
+        del state['f']
+        del state['_coeffs']
+        del state['_grads']
+        del state['_local']
+        state['_expansion'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Recreate the lambdified functions after unpickling."""
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._compile(self._sources)
 
     @property
     def sys(self):
@@ -46,6 +224,7 @@ class Tf(SystemBase):
     @sys.setter
     def sys(self, value):
         """Setter for sys"""
+        import sympy
         if not isinstance(value, tuple(sympy.core.all_classes)):
             raise TypeError("sys is not a sympy object")
         self._sys = value
@@ -63,38 +242,171 @@ class Tf(SystemBase):
             num: numerator coefficients
             den: denominator coefficients
         """
-        if isinstance(parameters, dict):
-            par = [None]*len(self.atoms_list)
-            for idx, atom in enumerate(self.atoms_list):
-                par[idx] = parameters[atom]
-        else:
-            par = parameters
+        num, den = self.coefficients(self._parameter_list(parameters))
+
+        # Leading coefficients may vanish for some parameter values, which
+        # lowers the order of the polynomial.
+        return _trim(num), _trim(den)
 
-        # Extract the numerator and denominator
-        temp = self.f(*par)
+    def coefficients(self, parameters):
+        """Returns the untrimmed numerator and denominator coefficients.
 
-        # The control toolbox does not understand sympy integers. Therefore
-        # it is necessary to convert
-        num = np.asarray(sympy.Poly(sympy.numer(temp)).all_coeffs(), float)
-        den = np.asarray(sympy.Poly(sympy.denom(temp)).all_coeffs(), float)
+        The compiled coefficient functions are vectorized, so the parameters
+        may be arrays. The coefficients are stacked along the first axis.
 
-        return num, den
+        Args:
+           parameters: parameter values ordered as atoms_list
+
+        Returns:
+            num: numerator coefficients, highest power of s first
+            den: denominator coefficients, highest power of s first
+        """
+        num, den = self._coeffs(*parameters)
+        shape = _broadcast_shape(parameters)
+
+        return _stack(num, shape), _stack(den, shape)
+
+    def coefficient_gradients(self, parameters):
+        """Returns the derivatives of the coefficients.
+
+        Args:
+           parameters: parameter values as a dict or ordered as atoms_list
+
+        Returns:
+            dnum: (m, n_atoms) derivatives of the numerator coefficients
+            dden: (n+1, n_atoms) derivatives of the denominator coefficients
+        """
+        dnum, dden = self._grads(*self._parameter_list(parameters))
 
-    def time_response(self, parameters, x, t):
+        return (np.array(dnum, dtype=float).reshape(-1, self.n_atoms),
+                np.array(dden, dtype=float).reshape(-1, self.n_atoms))
+
+    def sensitivity_response(self, parameters, x, t, dt=None):
+        """Calculates the time response and its parameter sensitivities.
+
+        The sensitivities are obtained in the same simulation as the
+        response, by augmenting the system with the derivatives of its
+        states with respect to each parameter.
+
+        Args:
+            parameters: Value of the parameters in the system
+            x: Uniformly sampled input vector
+            t: Time vector
+            dt: Time step of t if it is already known
+
+        Returns:
+            y: The time response
+            dy: (len(t), n_atoms) array with the derivative of the response
+                with respect to each parameter, ordered as atoms_list
+        """
+        par = self._parameter_list(parameters)
+        x = np.asarray(x, dtype=float)
+        if dt is None:
+            dt = simulation.uniform_step(t)
+        if dt is None:
+            raise ValueError("Time values must be equally spaced.")
+
+        num, den = [coeff[:, 0] for coeff in self.coefficients(
+            np.asarray(par, dtype=float)[:, None])]
+        if den[0] == 0:
+            raise ValueError("The leading denominator coefficient is zero")
+        dnum, dden = self.coefficient_gradients(par)
+
+        A, B, C, D = simulation.sensitivity_ss(num, den, dnum, dden)
+        if not len(A):
+            return D[0]*x, np.outer(x, D[1:])
+        Ad, Bd0, Bd1 = simulation.discretize(A[None], B, dt,
+                                             self.discretization or 'foh')
+        states = simulation.simulate_states(Ad, Bd0, Bd1, x)[:, 0, :]
+        response = states.dot(C.T) + np.outer(x, D)
+
+        return response[:, 0], response[:, 1:]
+
+    def time_response(self, parameters, x, t, dt=None):
         """Method that calculates the time response of the system.
 
         Args:
             parameters: Value of the parameters in the system
             x: Input vector
             t: Time vector
+            dt: Time step of t if it is known to be uniformly sampled
 
         Returns:
             numpy array containint the time response
         """
+        start = timeit.default_timer()
         num, den = self.num_den(parameters)
+        middle = timeit.default_timer()
+        self.timers.add('coefficients', middle - start)
 
-        _, y, _ = control.forced_response(
-            control.tf(num, den), t, x)
+        if self.discretization is not None and dt is None:
+            dt = simulation.uniform_step(t)
+        if self.discretization is not None and dt is not None:
+            y = simulation.discrete_response(num, den, x, dt,
+                                             self.discretization)
+        else:
+            import control
+            _, y, _ = control.forced_response(
+                control.tf(num, den), t, x)
+        self.timers.add('simulate', timeit.default_timer() - middle)
+
+        return y
+
+    def batch_time_response(self, param_matrix, x, t, dt=None, out=None):
+        """Calculates the time response for several parameter sets.
+
+        The coefficients of all the parameter sets are evaluated at once and
+        the systems are simulated together in one stacked state space
+        recursion. Unless another discretization is selected, the same
+        first order hold discretization as control.forced_response is used.
+        Only the current and the next states are stored, in a work array
+        that is reused by the following calls of the same population size
+        in the same thread.
+
+        Args:
+            param_matrix: (N, n_atoms) array with one parameter set per row
+            x: Input vector
+            t: Time vector
+            dt: Time step of t if it is known to be uniformly sampled
+            out: Optional (N, len(t)) array the responses are written to
+
+        Returns:
+            (N, len(t)) array with one time response per row
+        """
+        param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+        x = np.asarray(x, dtype=float)
+        if dt is None:
+            dt = simulation.uniform_step(t)
+        if dt is None:
+            raise ValueError("Time values must be equally spaced.")
+
+        start = timeit.default_timer()
+        num, den = self.coefficients(param_matrix.T)
+        num, den = num.T, den.T
+        middle = timeit.default_timer()
+        self.timers.add('coefficients', middle - start, len(param_matrix))
+        y = np.empty((len(param_matrix), len(x))) if out is None else out
+
+        # Systems where the leading denominator coefficient vanishes have a
+        # lower order and are simulated one by one.
+        full = den[:, 0] != 0
+        if np.any(full):
+            A, B, C, D = simulation.canonical_ss(num[full], den[full])
+            if A.shape[1]:
+                Ad, Bd0, Bd1 = simulation.discretize(
+                    A, B, dt, self.discretization or 'foh')
+                states = self._work((len(A)*(2*A.shape[1] + 1),))
+                if np.all(full):
+                    simulation.simulate(Ad, Bd0, Bd1, C, D, x, y, states)
+                else:
+                    y[full] = simulation.simulate(Ad, Bd0, Bd1, C, D, x,
+                                                  states=states)
+            else:
+                y[full] = D[:, None]*x
+        self.timers.add('simulate', timeit.default_timer() - middle,
+                        np.count_nonzero(full))
+        for idx in np.flatnonzero(~full):
+            y[idx] = self.time_response(param_matrix[idx], x, t, dt)
 
         return y
 
@@ -111,7 +423,316 @@ class Tf(SystemBase):
             y: The step response.
             t: the time vector.
             """
-        num, den = self._num_den(parameters)
+        import control
+        num, den = self.num_den(parameters)
         t, y, _ = control.step_response(control.tf(num, den), t)
 
         return t, y
+
+
+class StateSpace(SystemBase):
+    """
+    Class for state space representation.
+
+    The system is given by symbolic A, B, C and D matrices in the
+    parameters, and can be built from transfer function blocks connected
+    in series, in parallel and in feedback. The blocks are connected as
+    state space systems, so the rational functions are never multiplied
+    out. That keeps the expressions small and avoids the poorly
+    conditioned polynomial coefficients of high order transfer functions.
+
+    Only the entries of the matrices that are not identically zero are
+    compiled, and they are written into matrices that are reused by the
+    following calls of the same size in the same thread.
+    """
+    def __init__(self, A, B, C, D, discretization='foh', cache=True):
+        """
+        Input:
+            A: (n, n) state matrix as a sympy Matrix or nested lists
+            B: (n, 1) input matrix
+            C: (1, n) output matrix
+            D: (1, 1) feedthrough matrix, or a scalar
+            discretization: 'foh', 'zoh' or 'tustin' discretization, see
+                simulation.discretize. The time vectors must be uniformly
+                sampled.
+            cache: Reuse the numeric functions compiled for the same
+                matrices from the on-disk cache, see pypiw.cache
+
+        The numeric functions are compiled on first use, so that the
+        intermediate systems of a block diagram are not compiled.
+        """
+        import sympy
+        super(StateSpace, self).__init__()
+        self.timers = instrumentation.PhaseTimer()
+        self._local = threading.local()
+        if discretization not in simulation.METHODS:
+            raise ValueError("No such discretization method")
+        self.discretization = discretization
+        self.cache = cache
+
+        self.A, self.B, self.C, self.D = [
+            sympy.Matrix(mat) for mat in (A, B, C, sympy.Matrix([D]))]
+        order = self.A.shape[0]
+        if (self.A.shape != (order, order) or self.B.shape != (order, 1) or
+                self.C.shape != (1, order) or self.D.shape != (1, 1)):
+            raise ValueError("A must be (n, n), B (n, 1), C (1, n) and D "
+                             "(1, 1)")
+        self.n_states = order
+
+        self.atoms = set().union(*[mat.free_symbols for mat in
+                                   (self.A, self.B, self.C, self.D)])
+        self.symbols = sorted(self.atoms, key=str)
+        self.atoms_list = [str(atom) for atom in self.symbols]
+        self.n_atoms = len(self.atoms)
+
+        # Position of the non-zero entries in the flattened [A B C D]
+        self._entries = [
+            (offset + idx, value) for offset, mat in zip(
+                np.cumsum([0, order**2, order, order]),
+                (self.A, self.B, self.C, self.D))
+            for idx, value in enumerate(mat) if value != 0]
+        self._source = None
+        self._matrices = None
+
+    @classmethod
+    def from_tf(cls, sys, discretization='foh', cache=True):
+        """Returns the controllable canonical realization of a block.
+
+        Args:
+            sys: Proper transfer function given as a sympy expression in s
+            discretization: See StateSpace
+            cache: See StateSpace
+
+        Returns:
+            StateSpace with one state per pole of the block
+        """
+        import sympy
+        s = sympy.symbols('s')
+        num, den = sympy.fraction(sympy.together(sys))
+        if sympy.degree(den, s) < sympy.degree(num, s):
+            raise ValueError("System is not proper")
+
+        den = sympy.Poly(den, s).all_coeffs()
+        num = sympy.Poly(num, s).all_coeffs()
+        order = len(den) - 1
+        a = [coeff/den[0] for coeff in den[1:]]
+        b = [0]*(order + 1 - len(num)) + [coeff/den[0] for coeff in num]
+
+        A = sympy.zeros(order, order)
+        for col in range(order):
+            A[0, col] = -a[col]
+        for row in range(1, order):
+            A[row, row - 1] = 1
+        B = sympy.zeros(order, 1)
+        if order:
+            B[0] = 1
+        C = sympy.Matrix([[b[col + 1] - a[col]*b[0]
+                           for col in range(order)]]).reshape(1, order)
+
+        return cls(A, B, C, b[0], discretization, cache)
+
+    def _connected(self, A, B, C, D):
+        """Returns a system with the settings of this one."""
+        return StateSpace(A, B, C, D, self.discretization, self.cache)
+
+    def series(self, other):
+        """Returns the system followed by other."""
+        import sympy
+        other = _as_state_space(other)
+        A = sympy.diag(self.A, other.A)
+        A[self.n_states:, :self.n_states] = other.B*self.C
+
+        return self._connected(
+            A, self.B.col_join(other.B*self.D),
+            (other.D*self.C).row_join(other.C), other.D*self.D)
+
+    def parallel(self, other):
+        """Returns the sum of the outputs of the system and other."""
+        import sympy
+        other = _as_state_space(other)
+
+        return self._connected(
+            sympy.diag(self.A, other.A), self.B.col_join(other.B),
+            self.C.row_join(other.C), self.D + other.D)
+
+    def feedback(self, other=1, sign=-1):
+        """Returns the system with other in its feedback path.
+
+        The input of the system is the external input plus sign times the
+        output of other, which is driven by the output of the system. An
+        algebraic loop through the feedthrough terms is solved
+        symbolically.
+
+        Args:
+            other: System or transfer function in the feedback path,
+                unity feedback by default
+            sign: -1 for negative and 1 for positive feedback
+
+        Returns:
+            The closed loop StateSpace
+        """
+        import sympy
+        other = _as_state_space(other)
+        gain = 1/(1 - sign*self.D[0]*other.D[0])
+
+        # Output, and input of the system, as functions of the states
+        # [x, x_other] and the external input.
+        C = gain*self.C.row_join(sign*self.D[0]*other.C)
+        D = gain*self.D
+        E = sympy.zeros(1, self.n_states).row_join(sign*other.C) + \
+            sign*other.D[0]*C
+        F = sympy.ones(1, 1) + sign*other.D[0]*D
+
+        A = (sympy.diag(self.A, other.A) +
+             self.B.col_join(sympy.zeros(other.n_states, 1))*E +
+             sympy.zeros(self.n_states, 1).col_join(other.B)*C)
+        B = (self.B.col_join(sympy.zeros(other.n_states, 1))*F +
+             sympy.zeros(self.n_states, 1).col_join(other.B)*D)
+
+        return self._connected(A, B, C, D)
+
+    def _compile(self):
+        """Create the function evaluating the non-zero matrix entries."""
+        import sympy
+        if self._matrices is not None:
+            return
+        key = (pypiw_cache.key('StateSpace', (self.A, self.B, self.C, self.D))
+               if self.cache else None)
+        entry = pypiw_cache.load(key) if self.cache else None
+        self._matrices, source = pypiw_cache.lambdify(
+            self.symbols, [value for _, value in self._entries],
+            entry and entry['source'], self.atoms)
+        if self.cache and entry is None:
+            pypiw_cache.store(key, {'atoms_list': self.atoms_list,
+                                    'source': source})
+        self._source = source
+
+    def __getstate__(self):
+        """The compiled function can not be pickled, send its source."""
+        state = self.__dict__.copy()
+        del state['_matrices']
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        """Recreate the compiled function after unpickling."""
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._matrices = None
+        if self._source is not None:
+            self._matrices, _ = pypiw_cache.lambdify(
+                self.symbols, None, self._source, self.atoms)
+
+    def matrices(self, param_matrix):
+        """Returns the numeric matrices of several parameter sets.
+
+        The matrices are views of a work array that is overwritten by the
+        next call in the same thread.
+
+        Args:
+            param_matrix: (N, n_atoms) array with one parameter set per row
+
+        Returns:
+            A: (N, n, n) state matrices
+            B: (N, n) input vectors
+            C: (N, n) output vectors
+            D: (N,) feedthrough terms
+        """
+        self._compile()
+        param_matrix = np.atleast_2d(np.asarray(param_matrix, dtype=float))
+        n_sys, order = len(param_matrix), self.n_states
+        flat = self._work((n_sys, order**2 + 2*order + 1), 'matrices')
+        if self._entries:
+            values = _stack(self._matrices(*param_matrix.T), (n_sys,))
+            flat[:, [idx for idx, _ in self._entries]] = values.T
+
+        return (flat[:, :order**2].reshape(n_sys, order, order),
+                flat[:, order**2:order**2 + order],
+                flat[:, order**2 + order:-1], flat[:, -1])
+
+    def time_response(self, parameters, x, t, dt=None):
+        """Method that calculates the time response of the system.
+
+        Args:
+            parameters: Value of the parameters in the system
+            x: Input vector
+            t: Time vector
+            dt: Time step of t if it is known to be uniformly sampled
+
+        Returns:
+            numpy array containing the time response
+        """
+        return self.batch_time_response(
+            [self._parameter_list(parameters)], x, t, dt)[0]
+
+    def batch_time_response(self, param_matrix, x, t, dt=None, out=None):
+        """Calculates the time response for several parameter sets.
+
+        The systems are discretized and simulated together in one stacked
+        recursion. The matrices and the states are kept in work arrays
+        that are reused by the following calls of the same size in the
+        same thread.
+
+        Args:
+            param_matrix: (N, n_atoms) array with one parameter set per row
+            x: Input vector
+            t: Time vector
+            dt: Time step of t if it is known to be uniformly sampled
+            out: Optional (N, len(t)) array the responses are written to
+
+        Returns:
+            (N, len(t)) array with one time response per row
+        """
+        x = np.asarray(x, dtype=float)
+        if dt is None:
+            dt = simulation.uniform_step(t)
+        if dt is None:
+            raise ValueError("Time values must be equally spaced.")
+
+        start = timeit.default_timer()
+        A, B, C, D = self.matrices(param_matrix)
+        middle = timeit.default_timer()
+        self.timers.add('matrices', middle - start, len(A))
+        y = np.empty((len(A), len(x))) if out is None else out
+
+        if not self.n_states:
+            np.multiply(D[:, None], x, out=y)
+        else:
+            Ad, Bd0, Bd1 = simulation.discretize(A, B, dt,
+                                                 self.discretization)
+            states = self._work((len(B)*(2*B.shape[1] + 1),))
+            simulation.simulate(Ad, Bd0, Bd1, C, D, x, y, states)
+        self.timers.add('simulate', timeit.default_timer() - middle, len(A))
+
+        return y
+
+
+def _as_state_space(sys):
+    """Convert a transfer function expression to a StateSpace."""
+    if isinstance(sys, StateSpace):
+        return sys
+
+    import sympy
+    return StateSpace.from_tf(sympy.sympify(sys))
+
+
+def _broadcast_shape(parameters):
+    """Shape that all parameters broadcast to."""
+    shape = ()
+    for par in parameters:
+        shape = np.broadcast(np.empty(shape), par).shape
+
+    return shape
+
+
+def _stack(coeffs, shape):
+    """Stack coefficients that may be scalars or arrays into one array."""
+    return np.array([np.broadcast_to(np.asarray(coeff, dtype=float), shape)
+                     for coeff in coeffs])
+
+
+def _trim(coeffs):
+    """Remove leading zero coefficients but keep at least one."""
+    trimmed = np.trim_zeros(coeffs, 'f')
+
+    return trimmed if len(trimmed) else coeffs[-1:]
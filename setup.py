@@ -1,16 +1,27 @@
 import os
+import re
 from setuptools import setup
 
 
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
+
+def version():
+    return re.search(r"__version__ = '(.*)'",
+                     read(os.path.join('pypiw', '__init__.py'))).group(1)
+
 setup(name='pypiw',
-      version='0.1',
+      version=version(),
       description='Testin setuptools, travis and pytest',
       url='http://github.com/hofsmo/PyPiW',
       author='Sigurd Hofsmo Jakobsen',
       author_email='sigurd.jakobsenatgmail.com',
       license='GPLv3',
       packages=['pypiw'],
+      extras_require={
+          'plotting': ['matplotlib'],
+          'parquet': ['pyarrow']},
+      entry_points={
+          'console_scripts': ['pypiw-fleet=pypiw.fleet:main']},
       zip_safe=False)
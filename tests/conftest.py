@@ -0,0 +1,9 @@
+"""Shared test configuration."""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmpdir_factory):
+    """Keep the compilation cache of the tests out of the user cache."""
+    monkeypatch.setenv('PYPIW_CACHE_DIR',
+                       str(tmpdir_factory.getbasetemp().join('cache')))
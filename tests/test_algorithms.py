@@ -1,10 +1,16 @@
 """Module for testing algorithms."""
 from collections import namedtuple
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
+import pickle
+import sys
 import pytest
 import sympy
 import control
 import numpy as np
-from pypiw import systems, algorithms
+from deap import base, creator, tools
+from pypiw import systems, algorithms, data, objectives
 
 
 @pytest.fixture(scope='session')
@@ -43,3 +49,492 @@ def test_compare(ga, tf, data_vec):
 def test_ga(ga, tf):
     ga.identify()
     np.testing.assert_almost_equal(ga.identified_parameters()['T2'], -3.0, 0)
+
+
+def test_batch_compare(ga, data_vec):
+    """Test the batched compare method"""
+    parameters = [[2.0, -3.0], [1.0, 2.0]]
+
+    np.testing.assert_allclose(
+        ga.batch_compare(parameters),
+        [ga.compare(parameter)[0] for parameter in parameters])
+
+
+@pytest.mark.parametrize('saved', [False, True])
+def test_parallel_map(data_vec, tf, tmp_path, saved):
+    """Test that worker processes give the same fitness as one process"""
+    in_data = data_vec.x
+    if saved:
+        # The workers map the saved record instead of receiving a copy
+        in_data = str(tmp_path / 'record.npy')
+        data.Record(data_vec.x, data_vec.y, data_vec.t).save(in_data)
+    ga = algorithms.Ga(in_data, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, n_jobs=2)
+    try:
+        fitness = ga.toolbox.map(ga.toolbox.evaluate, ga.pop)
+    finally:
+        ga.close()
+
+    np.testing.assert_allclose(
+        np.ravel(fitness), ga.batch_compare(ga.pop))
+
+
+def test_executor(data_vec, tf):
+    """Test that a thread pool evaluates as one process and that process
+    pools are rejected"""
+    executor = ThreadPool(2)
+    try:
+        ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                           nind=20, n_jobs=2, executor=executor)
+        fitness = ga.toolbox.map(ga.toolbox.evaluate, ga.pop)
+    finally:
+        executor.close()
+
+    np.testing.assert_allclose(
+        np.ravel(fitness), ga.batch_compare(ga.pop))
+    pool = multiprocessing.Pool(1)
+    try:
+        with pytest.raises(ValueError):
+            algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                          executor=pool)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def test_fitness_cache(data_vec, tf):
+    """Test that repeated individuals are taken from the cache"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=4, cache_size=3)
+    parameters = [[2.0, -3.0], [1.0, 2.0], [2.0, -3.0]]
+
+    np.testing.assert_allclose(
+        ga.batch_compare(parameters),
+        [ga.compare(parameter)[0] for parameter in parameters])
+    assert ga.cache_info()['hits'] == 4
+    assert ga.cache_info()['misses'] == 2
+
+
+def test_fitness_cache_eviction():
+    """Test that the least recently used entries are evicted"""
+    cache = algorithms.FitnessCache(2)
+    cache.put(cache.key([1.0]), 1.0)
+    cache.put(cache.key([2.0]), 2.0)
+    cache.get(cache.key([1.0]))
+    cache.put(cache.key([3.0]), 3.0)
+
+    assert len(cache) == 2
+    assert cache.get(cache.key([2.0])) is None
+    assert cache.get(cache.key([1.0 + 1e-12])) == 1.0
+
+
+def test_enforce_bounds():
+    """Test clipping and reflection of genes outside the bounds"""
+    genes = np.array([[-1.0, 5.0], [0.5, 12.0]])
+    lower = np.array([0.0, 2.0])
+    upper = np.array([1.0, 10.0])
+
+    np.testing.assert_allclose(
+        algorithms.enforce_bounds(genes, lower, upper),
+        [[0.00001, 5.0], [0.5, 10.0 - 0.00001]])
+    np.testing.assert_allclose(
+        algorithms.enforce_bounds(genes, lower, upper, 'reflect'),
+        [[1.0, 5.0], [0.5, 8.0]])
+
+
+def test_parameter_bounds(data_vec, tf):
+    """Test bounds given per parameter"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf,
+                       {'T1': 1.0, 'T2': -4.0}, {'T1': 3.0, 'T2': -2.0},
+                       nind=50, ngen=2)
+    ga.identify()
+    genes = np.array(ga.pop)
+
+    assert np.all(genes >= [1.0, -4.0]) and np.all(genes <= [3.0, -2.0])
+
+
+def test_ga_compact(data_vec, tf):
+    """Test the array backed population"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       compact=True)
+    ga.identify()
+
+    assert ga.pop.shape == (ga.nind, tf.n_atoms)
+    assert not np.any(np.isnan(ga.fitness))
+    np.testing.assert_almost_equal(ga.identified_parameters()['T2'], -3.0, 0)
+
+
+@pytest.mark.parametrize('criteria, reason', [
+    ({}, 'ngen'),
+    ({'tol': np.inf}, 'tol'),
+    ({'stall': 0}, 'stall'),
+    ({'time_budget': 0.0}, 'time_budget'),
+    ({'max_evals': 1}, 'max_evals')])
+def test_ga_stopping(data_vec, tf, criteria, reason):
+    """Test the reason reported for stopping the identification"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=3)
+    result = ga.identify(**criteria)
+
+    assert result.reason == reason
+    assert result.ngen == (3 if reason == 'ngen' else 0)
+    assert result.nevals == sum(ga.logbook.select('nevals'))
+
+
+def test_ga_elapsed(data_vec, tf):
+    """Test that the time covers every generation and restarts per run"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=3)
+    first = ga.identify(time_budget=60)
+    assert first.elapsed >= sum(ga.logbook.select('time'))
+
+    # A new run does not continue the time of the earlier one
+    ga.elapsed = 100.0
+    second = ga.identify(time_budget=60)
+    assert first.reason == second.reason == 'ngen'
+    assert second.elapsed < 60
+
+
+def test_residual(ga, data_vec):
+    """Test that the residual gives the same fitness as compare"""
+    parameters = [1.0, 2.0]
+
+    np.testing.assert_almost_equal(
+        np.linalg.norm(ga.residual(parameters)), ga.compare(parameters)[0])
+
+
+def test_ga_refine(data_vec, tf):
+    """Test the least squares refinement of the hall of fame"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=50, ngen=5, refine=True, nrefine=2)
+    ga.identify()
+
+    np.testing.assert_almost_equal(ga.identified_parameters()['T1'], 2.0, 4)
+    np.testing.assert_almost_equal(ga.identified_parameters()['T2'], -3.0, 4)
+
+
+def test_ga_refine_pinned(data_vec, tf):
+    """Test that parameters with equal bounds stay pinned in refinement"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf,
+                       {'T1': 1.5, 'T2': -5}, {'T1': 1.5, 'T2': 5}, nind=20,
+                       ngen=2, refine=True)
+    ga.identify()
+
+    assert ga.identified_parameters()['T1'] == 1.5
+    solution = ga.refine([1.5, -2.0], jac='2-point')
+    assert solution.x[0] == 1.5
+    np.testing.assert_allclose(solution.x, ga.refine([1.5, -2.0]).x,
+                               rtol=1e-6)
+
+
+def test_jacobian(ga):
+    """Test the analytic jacobian against finite differences"""
+    parameters = np.array([1.0, 2.0])
+    step = 1e-6
+
+    diff = np.transpose([
+        (ga.residual(parameters + dp) - ga.residual(parameters - dp))/2/step
+        for dp in np.eye(2)*step])
+
+    np.testing.assert_allclose(ga.jacobian(parameters), diff, atol=1e-6)
+
+
+def test_multiple_records(data_vec, tf):
+    """Test the fitness over several records"""
+    t_short = np.arange(0, 2, 0.05)
+    x_short = np.sin(t_short)
+    y_short = tf.time_response(data_vec.parameters, x_short, t_short)
+    records = [data.Record(data_vec.x, data_vec.y, data_vec.t),
+               data.Record(x_short, y_short, t_short)]
+    ga = algorithms.Ga(records, None, None, tf, -5, 5, nind=4)
+    fitness = [algorithms.Ga(record, None, None, tf, -5, 5,
+                             nind=4).compare([1.0, 2.0])[0]
+               for record in records]
+    expected = np.sqrt((100*fitness[0]**2 + 40*fitness[1]**2)/140)
+
+    np.testing.assert_allclose(
+        ga.batch_compare([[2.0, -3.0], [1.0, 2.0]]), [0, expected],
+        atol=1e-10)
+    np.testing.assert_almost_equal(ga.compare([1.0, 2.0])[0], expected)
+    np.testing.assert_almost_equal(
+        np.linalg.norm(ga.residual([1.0, 2.0])), expected)
+    ga.close()
+
+
+def test_pickle_multiple_records(data_vec, tf):
+    """Check that a Ga with several records evaluates after pickling."""
+    t_short = np.arange(0, 2, 0.05)
+    x_short = np.sin(t_short)
+    records = [data.Record(data_vec.x, data_vec.y, data_vec.t),
+               data.Record(x_short, tf.time_response(
+                   data_vec.parameters, x_short, t_short), t_short)]
+    ga = algorithms.Ga(records, None, None, tf, -5, 5, nind=4)
+    ga.batch_compare([[2.0, -3.0]])
+    copy = pickle.loads(pickle.dumps(ga))
+    try:
+        np.testing.assert_allclose(
+            copy._batch_compare(np.array([[2.0, -3.0], [1.0, 2.0]])),
+            ga.batch_compare([[2.0, -3.0], [1.0, 2.0]]))
+    finally:
+        ga.close()
+        algorithms.AlgorithmBase.close(copy)
+
+
+@pytest.mark.skipif(sys.platform == 'win32',
+                    reason="Worker processes can not fork on Windows")
+def test_fork_multiple_records(data_vec, tf, monkeypatch):
+    """Check that forked workers do not use the record threads of the
+    parent."""
+    if hasattr(multiprocessing, 'get_context'):
+        monkeypatch.setattr(multiprocessing, 'Pool',
+                            multiprocessing.get_context('fork').Pool)
+    t_short = np.arange(0, 2, 0.05)
+    x_short = np.sin(t_short)
+    records = [data.Record(data_vec.x, data_vec.y, data_vec.t),
+               data.Record(x_short, tf.time_response(
+                   data_vec.parameters, x_short, t_short), t_short)]
+    ga = algorithms.Ga(records, None, None, tf, -5, 5, nind=10, ngen=2,
+                       n_jobs=2, refine=True)
+    parameters = [[2.0, -3.0], [1.0, 2.0]]
+    try:
+        # Both the batch and the refinement start the record threads
+        # before the worker processes are forked.
+        expected = ga.batch_compare(parameters)
+        fitness = ga._parallel_compare(np.array(parameters))
+        ga.identify()
+        ga.identify()
+    finally:
+        ga.close()
+
+    np.testing.assert_allclose(fitness, expected)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_checkpoint_resume(data_vec, tf, tmp_path, compact):
+    """Test that a resumed run continues as an uninterrupted one"""
+    path = str(tmp_path / 'run.npz')
+    algorithms.seed(1)
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=6, compact=compact)
+    expected = ga.identify()
+    logbook = ga.logbook
+
+    algorithms.seed(1)
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=3, compact=compact)
+    ga.identify(checkpoint=path)
+    algorithms.seed(2)
+    resumed = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                            nind=20, ngen=6, compact=compact)
+    result = resumed.identify(resume=path)
+
+    assert result.nevals == expected.nevals
+    assert result.fitness == expected.fitness
+    assert resumed.logbook.select('min') == logbook.select('min')
+
+
+def test_checkpoint_overwrite(data_vec, tf, tmp_path, monkeypatch):
+    """Test that checkpoints are replaced where rename can not overwrite"""
+    os_rename = os.rename
+
+    def rename(source, destination):
+        if os.path.exists(destination):
+            raise OSError("File exists")
+        os_rename(source, destination)
+
+    monkeypatch.setattr(os, 'rename', rename)
+    path = str(tmp_path / 'run.npz')
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=10, ngen=3)
+    result = ga.identify(checkpoint=path)
+
+    with np.load(path) as state:
+        assert int(state['gen']) == result.ngen
+
+
+def test_warm_start(data_vec, tf, tmp_path):
+    """Test starting a new run from a checkpoint"""
+    path = str(tmp_path / 'run.npz')
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=3)
+    ga.identify(checkpoint=path)
+    warm = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                         nind=30, ngen=0)
+    warm.warm_start(path)
+
+    assert len(warm.pop) == 30
+    assert not any(ind.fitness.valid for ind in warm.pop)
+    assert warm.identify().fitness == ga.result.fitness
+
+
+def test_seeded_population(data_vec, tf):
+    """Test starting the population from earlier parameters"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=2, seeds={'T1': 2.1, 'T2': -2.9},
+                       seed_fraction=0.25)
+    genes = np.array(ga.pop)
+
+    np.testing.assert_allclose(genes[0], [2.1, -2.9])
+    np.testing.assert_allclose(genes[:5], [[2.1, -2.9]]*5, rtol=0.5)
+    # The unperturbed seed is evaluated, so the run does at least as well
+    assert ga.identify().fitness <= ga.compare([2.1, -2.9])[0]
+
+
+def test_seeded_population_dicts(data_vec, tf):
+    """Test seeding with several earlier identified parameters"""
+    seeds = [{'T1': 2.1, 'T2': -2.9}, {'T1': 1.5, 'T2': -3.5}]
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, seeds=seeds)
+
+    np.testing.assert_allclose(np.array(ga.pop)[:2],
+                               [[2.1, -2.9], [1.5, -3.5]])
+
+
+def test_profile(data_vec, tf, tmp_path):
+    """Test the counters, timers and the exported logbook"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=3)
+    result = ga.identify()
+    info = ga.profile_info()
+
+    assert info['algorithm']['evaluate']['count'] == 4
+    assert info['algorithm']['vary']['count'] == 3
+    assert info['system']['simulate']['count'] >= result.nevals
+    records = ga.log_records()
+    assert [record['gen'] for record in records] == [0, 1, 2, 3]
+    assert records[0]['time_vary'] == 0.0
+    assert records[1]['time'] >= records[1]['time_evaluate'] > 0
+    path = str(tmp_path / 'log.csv')
+    ga.save_log(path)
+    assert open(path).readline().startswith('gen,nevals,std,min,time')
+
+
+def test_callback(data_vec, tf):
+    """Test that the callback is called each generation and can stop"""
+    generations = []
+
+    def callback(ga, record):
+        generations.append(record['gen'])
+        return record['gen'] == 2
+
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=5)
+
+    assert ga.identify(callback=callback).reason == 'callback'
+    assert generations == [0, 1, 2]
+
+
+def test_cma(data_vec, tf):
+    """Test the CMA-ES within the bounds"""
+    algorithms.seed(0)
+    cma = algorithms.Cma(data_vec.x, data_vec.y, data_vec.t, tf,
+                         {'T1': 0.0, 'T2': -5.0}, {'T1': 5.0, 'T2': -2.5},
+                         popsize=10)
+    result = cma.identify(tol=1e-3)
+
+    assert result.reason == 'tol'
+    assert result.nevals == 10*result.ngen
+    np.testing.assert_almost_equal(cma.identified_parameters()['T2'], -3.0,
+                                   2)
+
+    algorithms.seed(0)
+    assert cma.identify(tol=1e-3) == result._replace(
+        elapsed=cma.result.elapsed)
+
+
+def test_ga_generate(data_vec, tf):
+    """Test that algorithm='generate' runs the CMA-ES"""
+    algorithms.seed(0)
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=200)
+    result = ga.identify(algorithm='generate', tol=1e-3)
+
+    assert result.reason == 'tol'
+    np.testing.assert_almost_equal(ga.identified_parameters()['T2'], -3.0, 2)
+
+
+def test_coarse_to_fine(data_vec, tf):
+    """Test scoring the first generations on decimated records"""
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=50, ngen=10, coarse=5, coarse_stall=2)
+    ga.identify()
+
+    assert ga.records is ga.full_records
+    assert ga.hof[0].fitness.values == ga.compare(ga.hof[0])
+    np.testing.assert_almost_equal(ga.identified_parameters()['T2'], -3.0, 0)
+
+
+def test_coarse_to_fine_workers(data_vec, tf):
+    """Check that the workers score the full records after the switch"""
+    algorithms.seed(0)
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                       nind=20, ngen=6, coarse=5, coarse_stall=1, n_jobs=2)
+    ga.identify()
+    genes, fitness = ga._genes()
+
+    np.testing.assert_allclose(ga.hof[0].fitness.values,
+                               ga.compare(ga.hof[0]))
+    np.testing.assert_allclose(fitness, ga.batch_compare(genes))
+
+
+def test_coarse_weights(data_vec, tf):
+    """Weights given per sample can not be used on decimated records"""
+    weights = np.ones(len(data_vec.t))
+    with pytest.raises(ValueError):
+        algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+                      coarse=5, objective=objectives.WeightedSse(weights))
+    algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, tf, -5, 5, coarse=5,
+                  objective=objectives.WeightedSse(np.ones_like))
+
+
+def test_state_space(data_vec):
+    """Check that a state space system can be identified."""
+    s, T1, T2 = sympy.symbols('s T1 T2')
+    sys = systems.StateSpace.from_tf((1+s*T1)/(1+s*T2))
+    ga = algorithms.Ga(data_vec.x, data_vec.y, data_vec.t, sys, -5, 5)
+
+    np.testing.assert_allclose(ga.batch_compare([[2.0, -3.0]]), 0,
+                               atol=1e-8)
+
+
+def test_non_dominated_ranks():
+    """Check the fronts against the sorting of DEAP."""
+    fitness = np.random.RandomState(0).random_sample((200, 3))
+    ranks = algorithms.non_dominated_ranks(fitness)
+    creator.create('FitnessMin3', base.Fitness, weights=(-1.0, -1.0, -1.0))
+    creator.create('Individual3', list, fitness=creator.FitnessMin3)
+    individuals = []
+    for idx, values in enumerate(fitness):
+        individual = creator.Individual3([idx])
+        individual.fitness.values = tuple(values)
+        individuals.append(individual)
+
+    for rank, front in enumerate(tools.sortNondominated(individuals, 200)):
+        assert all(ranks[individual[0]] == rank for individual in front)
+
+    distance = algorithms.crowding_distance(fitness, ranks)
+    for rank in np.unique(ranks):
+        front = fitness[ranks == rank]
+        assert np.isinf(distance[ranks == rank][np.argmin(front[:, 0])])
+
+
+def test_nsga2(data_vec, tf, tmp_path):
+    """Check the Pareto front of the fit and the nameplate deviation."""
+    algorithms.seed(1)
+    nsga2 = algorithms.Nsga2(
+        data_vec.x, data_vec.y, data_vec.t, tf, -5, 5,
+        objectives=[objectives.Std(), objectives.Rmse(windows=[(0, 3)])],
+        nameplate={'T1': 1.0, 'T2': -2.0}, nind=40, ngen=30)
+    result = nsga2.identify()
+
+    assert not algorithms.dominance(nsga2.front_fitness).any()
+    assert result.fitness == nsga2.front_fitness[:, 0].min()
+    assert nsga2.front_fitness[:, 2].min() < 0.1
+    np.testing.assert_allclose(
+        [nsga2.identified_parameters()[atom] for atom in tf.atoms_list],
+        [2.0, -3.0], atol=0.5)
+
+    path = str(tmp_path / 'front.csv')
+    nsga2.save_front(path)
+    with open(path) as front:
+        assert len(front.readlines()) == len(nsga2.front) + 1
@@ -0,0 +1,78 @@
+"""
+Module for testing the data module
+"""
+import pickle
+import pytest
+import numpy as np
+from pypiw import data
+
+
+def test_record():
+    """Check that a record stores contiguous float arrays."""
+    time = np.arange(0, 1, 0.1)
+    record = data.Record(list(range(10)), np.ones(10), time)
+
+    assert record.in_data.dtype == np.float64
+    assert record.in_data.flags['C_CONTIGUOUS']
+    assert len(record) == 10
+    np.testing.assert_almost_equal(record.dt, 0.1)
+
+
+def test_record_length():
+    """Check that vectors of different length are rejected."""
+    with pytest.raises(ValueError):
+        data.Record(np.ones(3), np.ones(4), np.arange(3))
+
+
+def test_as_records():
+    """Check conversion of algorithm arguments to records."""
+    record = data.Record(np.ones(3), np.ones(3), np.arange(3))
+
+    assert data.as_records([record, record], None, None) == [record, record]
+    assert len(data.as_records(np.ones(3), np.ones(3), np.arange(3))) == 1
+
+
+def test_decimate():
+    """Check that decimation keeps every n'th sample."""
+    record = data.Record(np.arange(10), np.arange(10), np.arange(10)*0.1)
+    decimated = record.decimate(3)
+
+    np.testing.assert_allclose(decimated.in_data, [0, 3, 6, 9])
+    np.testing.assert_almost_equal(decimated.dt, 0.3)
+
+
+def test_load_record(tmpdir):
+    """Check that a saved record is memory mapped and pickled as its path."""
+    path = str(tmpdir.join('record.npy'))
+    time = np.arange(0, 100, 0.1)
+    data.Record(np.sin(time), np.cos(time), time).save(path)
+    record = data.load_record(path)
+
+    assert record.in_data.flags['C_CONTIGUOUS']
+    assert isinstance(record.in_data.base, np.memmap)
+    np.testing.assert_allclose(record.out_data, np.cos(time))
+    np.testing.assert_almost_equal(record.dt, 0.1)
+
+    pickled = pickle.dumps(record)
+    assert len(pickled) < record.time.nbytes
+    copy = pickle.loads(pickled)
+    assert isinstance(copy.in_data.base, np.memmap)
+    np.testing.assert_allclose(copy.in_data, record.in_data)
+
+    assert data.as_records(path, None, None)[0].path == record.path
+
+
+def test_convert_binary(tmpdir):
+    """Check chunked conversion of interleaved raw samples."""
+    time = np.arange(0, 10, 0.5)
+    raw = np.stack([time, 2*time, np.zeros_like(time), 3*time], axis=1)
+    source = str(tmpdir.join('record.bin'))
+    raw.astype('<f4').tofile(source)
+
+    record = data.convert_binary(source, str(tmpdir.join('record.npy')), 4,
+                                 channels=(1, 3, 0), dtype='<f4',
+                                 chunk_size=7)
+
+    np.testing.assert_allclose(record.in_data, 2*time)
+    np.testing.assert_allclose(record.out_data, 3*time)
+    np.testing.assert_allclose(record.time, time)
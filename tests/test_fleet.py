@@ -0,0 +1,84 @@
+"""
+Module for testing the fleet module
+"""
+import csv
+import json
+import os
+import numpy as np
+import pytest
+from pypiw import fleet, systems
+
+MODEL = "(1+s*T1)/(1+s*T2)"
+
+
+@pytest.fixture(scope='module')
+def recordings(tmpdir_factory):
+    """Create a directory with the recordings of three units."""
+    directory = tmpdir_factory.mktemp('recordings')
+    sys = systems.Tf(fleet.parse_model(MODEL))
+    t = np.arange(0, 10, 0.1)
+    x = np.ones(len(t))
+    for unit, parameters in [('a', [2.0, 3.0]), ('b', [1.0, 4.0])]:
+        y = sys.time_response(parameters, x, t)
+        np.savetxt(str(directory.join(unit + '.csv')),
+                   np.column_stack((t, y, x)), delimiter=',',
+                   header='time,out,in', comments='')
+    directory.join('broken.csv').write('time,out\n1,2\n')
+
+    return str(directory)
+
+
+def test_discover(recordings):
+    """Check that each CSV file is a unit."""
+    units = fleet.discover(recordings)
+
+    assert [unit for unit, _ in units] == ['a', 'b', 'broken']
+
+
+def test_read_manifest(tmpdir):
+    """Check that units may have several recordings."""
+    manifest = tmpdir.join('manifest.csv')
+    manifest.write('unit,path\na,1.csv\nb,2.csv\na,3.csv\n')
+
+    units = fleet.read_manifest(str(manifest))
+
+    assert [(unit, [os.path.basename(path) for path in paths])
+            for unit, paths in units] == [('a', ['1.csv', '3.csv']),
+                                          ('b', ['2.csv'])]
+
+
+def test_identify_fleet(recordings, tmpdir):
+    """Check that all units are identified and failures are reported."""
+    output = str(tmpdir.join('results.jsonl'))
+    jobs = [fleet.Job(unit, paths, MODEL, 0.1, 5,
+                      ga_options={'nind': 50, 'ngen': 20, 'refine': True},
+                      seed=1)
+            for unit, paths in fleet.discover(recordings)]
+
+    fleet.identify_fleet(jobs, output, n_jobs=2)
+
+    with open(output) as results:
+        results = {row['unit']: row for row in map(json.loads, results)}
+    assert results['broken']['status'] == 'error'
+    assert results['a']['status'] == 'ok'
+    np.testing.assert_almost_equal(results['a']['T2'], 3.0, 3)
+    np.testing.assert_almost_equal(results['b']['T1'], 1.0, 3)
+
+
+def test_identify_fleet_models(recordings, tmpdir):
+    """Check that the parameters of every model are written."""
+    output = str(tmpdir.join('results.csv'))
+    paths = dict(fleet.discover(recordings))
+    jobs = [fleet.Job('a', paths['a'], MODEL, 0.1, 5,
+                      ga_options={'nind': 10, 'ngen': 2}),
+            fleet.Job('b', paths['b'], "K/(1+s*T2)", 0.1, 5,
+                      ga_options={'nind': 10, 'ngen': 2}),
+            fleet.Job('c', paths['b'], "1/(1+s*", 0.1, 5)]
+
+    fleet.identify_fleet(jobs, output, n_jobs=2)
+
+    with open(output) as results:
+        results = {row['unit']: row for row in csv.DictReader(results)}
+    assert results['a']['T1'] and not results['a']['K']
+    assert results['b']['K'] and results['b']['T2']
+    assert results['c']['status'] == 'error'
@@ -0,0 +1,69 @@
+"""
+Module for testing the nonlinear module
+"""
+import pickle
+import pytest
+import sympy
+import numpy as np
+from pypiw import algorithms, nonlinear, systems
+
+
+@pytest.fixture(scope='module')
+def governor():
+    """Create a governor with a rate and gate limited servo."""
+    s, K, T1, T2, T3, R, G = sympy.symbols('s K T1 T2 T3 R Gmax')
+
+    return nonlinear.Chain([-K*(1+s*T2)/(1+s*T1), nonlinear.RateLimit(R),
+                            nonlinear.Saturation(-G, G), 1/(1+s*T3)])
+
+
+def test_inactive_limits(governor):
+    """Check that a chain with inactive limits is linear."""
+    s, K, T1, T2, T3 = sympy.symbols('s K T1 T2 T3')
+    linear = systems.StateSpace.from_tf(
+        -K*(1+s*T2)/(1+s*T1)).series(1/(1+s*T3))
+    t = np.arange(0, 50, 0.05)
+    x = 0.1*np.sin(0.3*t) + 0.1*(t > 5)
+
+    assert governor.atoms_list == ['Gmax', 'K', 'R', 'T1', 'T2', 'T3']
+    np.testing.assert_allclose(
+        governor.time_response([1e6, 20.0, 1e6, 4.0, 2.0, 8.0], x, t),
+        linear.time_response([20.0, 4.0, 2.0, 8.0], x, t), atol=1e-4)
+
+
+def test_static_blocks():
+    """Check the deadband and the saturation against their definition."""
+    width, limit = sympy.symbols('width limit')
+    sys = nonlinear.Chain([nonlinear.Deadband(width),
+                           nonlinear.Saturation(-limit, limit)])
+    t = np.arange(0, 4, 0.1)
+    x = t - 2
+
+    np.testing.assert_allclose(
+        sys.time_response({'width': 0.5, 'limit': 1.0}, x, t),
+        np.clip(x - np.clip(x, -0.5, 0.5), -1.0, 1.0))
+
+
+def test_rate_limit():
+    """Check that a step is turned into a ramp."""
+    rate = sympy.symbols('rate')
+    sys = nonlinear.Chain([nonlinear.RateLimit(rate)])
+    t = np.arange(0, 4, 0.1)
+
+    np.testing.assert_allclose(
+        sys.batch_time_response([[0.5], [2.0]], np.ones(len(t)), t),
+        [np.minimum(0.5*(t + 0.1), 1), np.minimum(2.0*(t + 0.1), 1)])
+
+
+def test_identify(governor):
+    """Check that the chain plugs into the algorithms and pickles."""
+    t = np.arange(0, 30, 0.05)
+    x = 0.1*(t > 1)
+    parameters = [0.5, 20.0, 0.2, 4.0, 2.0, 8.0]
+    y = governor.time_response(parameters, x, t)
+    ga = algorithms.Ga(x, y, t, pickle.loads(pickle.dumps(governor)),
+                       0.1, 30, nind=10)
+
+    np.testing.assert_allclose(ga.batch_compare([parameters]), 0,
+                               atol=1e-10)
+    assert ga.batch_compare([[2.0, 20.0, 0.2, 4.0, 2.0, 8.0]])[0] > 1e-3
@@ -0,0 +1,81 @@
+"""
+Module for testing the objectives module
+"""
+import numpy as np
+import pytest
+import sympy
+from pypiw import algorithms, data, objectives, systems
+
+
+@pytest.fixture(scope='module')
+def record():
+    """A record with a known error."""
+    t = np.arange(0, 10, 0.1)
+    return data.Record(np.ones(len(t)), np.sin(t), t)
+
+
+@pytest.fixture(scope='module')
+def error():
+    """Errors of two responses."""
+    return np.random.RandomState(0).normal(0, 1, (2, 100))
+
+
+@pytest.mark.parametrize('objective, expected', [
+    (objectives.Std(), lambda e: np.std(e, axis=1)),
+    (objectives.Rmse(), lambda e: np.sqrt(np.mean(e**2, axis=1))),
+    (objectives.WeightedSse(np.linspace(0, 1, 100)),
+     lambda e: np.sum(np.linspace(0, 1, 100)*e**2, axis=1)),
+    (objectives.Huber(0.5),
+     lambda e: np.mean(np.where(abs(e) < 0.5, e**2/2,
+                                0.5*(abs(e) - 0.25)), axis=1)),
+    (objectives.Cauchy(0.5),
+     lambda e: np.mean(0.125*np.log1p((e/0.5)**2), axis=1)),
+    (objectives.Rmse(windows=[(1, 2.95), (5, 6.95)], decimate=2),
+     lambda e: np.sqrt(np.mean(np.concatenate(
+         (e[:, 10:30:2], e[:, 50:70:2]), axis=1)**2, axis=1))),
+    (objectives.Std(mask=lambda t: t < 5),
+     lambda e: np.std(e[:, :50], axis=1)),
+])
+def test_fitness(record, error, objective, expected):
+    """Check the fitness against the definition of the objective."""
+    total = objective.totals(error.copy(), record)
+
+    np.testing.assert_allclose(
+        objective.fitness(total, objective.count(record)), expected(error))
+
+
+@pytest.mark.parametrize('objective', [
+    objectives.Std(), objectives.Rmse(windows=[(2, 8)]),
+    objectives.WeightedSse(lambda t: t)])
+def test_residual(record, error, objective):
+    """Check that least squares on the residual minimizes the fitness."""
+    count = objective.count(record)
+    residual = (objective.residual(error, record) *
+                objective.residual_scale(count))
+    fitness = objective.fitness(objective.totals(error.copy(), record),
+                                count)
+
+    np.testing.assert_allclose(np.sum(residual**2, axis=1),
+                               fitness if isinstance(
+                                   objective, objectives.WeightedSse)
+                               else fitness**2)
+
+
+def test_robust_refine():
+    """Check that the robust losses are hardly moved by outliers."""
+    s, T1, T2 = sympy.symbols('s T1 T2')
+    tf = systems.Tf((1+s*T1)/(1+s*T2), 'foh')
+    t = np.arange(0, 10, 0.05)
+    x = np.sin(t)
+    y = tf.time_response([2.0, 3.0], x, t)
+    y[::25] += 5
+
+    def refined(objective):
+        alg = algorithms.Ga(x, y, t, tf, 0.1, 5, nind=4, objective=objective)
+        return alg.refine([1.5, 2.5]).x
+
+    assert np.max(abs(refined(objectives.Rmse()) - [2.0, 3.0])) > 0.3
+    np.testing.assert_allclose(refined(objectives.Huber(0.1)), [2.0, 3.0],
+                               atol=0.05)
+    np.testing.assert_allclose(refined(objectives.Cauchy(0.1)), [2.0, 3.0],
+                               atol=1e-3)
@@ -0,0 +1,89 @@
+"""
+Module for testing the online module
+"""
+import sys
+import numpy as np
+import pytest
+import sympy
+from pypiw import algorithms, online, systems
+
+
+@pytest.fixture(scope='module')
+def stream():
+    """Chunks of a recording where T2 drifts from 0.5 to 0.8."""
+    s, T1, T2 = sympy.symbols('s T1 T2')
+    sys = systems.Tf((1+s*T1)/(1+s*T2), 'foh')
+    t = np.arange(0, 60, 0.1)
+    x = np.repeat(np.random.RandomState(0).uniform(-1, 1, 15), 45)[:600]
+    y = sys.time_response([2.0, 0.5], x, t)
+    y[300:] = sys.time_response([2.0, 0.8], x, t)[300:]
+
+    return sys, [(x[i:i+50], y[i:i+50], t[i:i+50])
+                 for i in range(0, len(t), 50)]
+
+
+def test_track(stream):
+    """Check that the estimates follow the drifting parameter."""
+    sys, chunks = stream
+    algorithms.seed(0)
+    tracker = online.OnlineIdentifier(sys, 0.1, 3, window=200,
+                                      ga_options={'refine': True})
+    estimates = list(tracker.track(chunks))
+
+    assert len(estimates) == 9
+    assert estimates[0].time == pytest.approx(19.9)
+    assert estimates[1].parameters['T2'] == pytest.approx(0.5, abs=0.05)
+    assert estimates[-1].parameters['T2'] == pytest.approx(0.8, abs=0.05)
+
+
+def test_step(stream):
+    """Check that updates wait for step new samples."""
+    sys, chunks = stream
+    tracker = online.OnlineIdentifier(sys, 0.1, 3, window=200, step=100,
+                                      ga_options={'ngen': 1, 'nind': 4})
+
+    assert len(list(tracker.track(chunks))) == 5
+
+
+class _Chunks(object):
+    """Asynchronous iterator over chunks, written without async syntax."""
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        import asyncio
+        future = asyncio.get_event_loop().create_future()
+        try:
+            future.set_result(next(self.chunks))
+        except StopIteration:
+            future.set_exception(StopAsyncIteration())
+        return future
+
+
+@pytest.mark.skipif(sys.version_info < (3, 6),
+                    reason="Asynchronous generators need Python 3.6")
+def test_atrack(stream):
+    """Check tracking an asynchronous stream."""
+    import asyncio
+    system, chunks = stream
+    tracker = online.OnlineIdentifier(system, 0.1, 3, window=200,
+                                      ga_options={'ngen': 1, 'nind': 4})
+    estimates = tracker.atrack(_Chunks(chunks))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    collected = []
+    try:
+        while True:
+            try:
+                collected.append(
+                    loop.run_until_complete(estimates.__anext__()))
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    assert len(collected) == 9
@@ -1,7 +1,41 @@
-from pypiw import pypiw
+import subprocess
+import sys
+import numpy as np
+import pytest
+import sympy
+from pypiw import algorithms, pypiw, systems
 
 
 def test_pypiw():
     a = pypiw.PyPiW([], [], [], [])
     assert(not a.in_data)
     assert(not a.out_data)
+
+
+def test_plot():
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    s, T1, T2 = sympy.symbols('s T1 T2')
+    tf = systems.Tf((1+s*T1)/(1+s*T2))
+    t = np.arange(0, 10, 0.1)
+    x = np.ones(len(t))
+    y = tf.time_response([2.0, 3.0], x, t)
+    ga = algorithms.Ga(x, y, t, tf, 1, 5, nind=10, ngen=1)
+    a = pypiw.PyPiW(x, y, t, ga)
+    a.identify()
+
+    assert len(a.plot().lines) == 2
+
+
+@pytest.mark.parametrize('module', ['pypiw.pypiw', 'pypiw.systems',
+                                    'pypiw.algorithms', 'pypiw.fleet'])
+def test_lazy_imports(module):
+    """Check that importing does not load the heavy dependencies."""
+    heavy = ['matplotlib', 'sympy', 'control', 'scipy.signal',
+             'scipy.optimize', 'deap']
+    loaded = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, {}; print(" ".join(name for name in {!r} '
+        'if name in sys.modules))'.format(module, heavy)])
+
+    assert loaded.split() == []
@@ -2,9 +2,11 @@
 Module for testing the systems module
 """
 from collections import namedtuple
+import pickle
 import pytest
 import sympy
 import control
+import pypiw
 from pypiw import systems
 import numpy as np
 
@@ -63,3 +65,176 @@ def test_time_response(tf, data_vec):
     y_sys = tf.time_response(data_vec.parameters, data_vec.x, data_vec.t)
 
     np.testing.assert_allclose(data_vec.y, y_sys)
+
+
+def test_num_den_matches_symbolic():
+    """Check the compiled coefficients against sympy substitution."""
+    s, K, T1, T2, T3 = sympy.symbols('s K T1 T2 T3')
+    expr = -K*(1+s*T2)/((1+s*T1)*(1+s*T3))
+    values = {K: 1.5, T1: 2.0, T2: 3.0, T3: 4.0}
+    sys = systems.Tf(expr)
+
+    num, den = sys.num_den({str(key): val for key, val in values.items()})
+    temp = expr.subs(values)
+
+    np.testing.assert_allclose(
+        num, np.asarray(sympy.Poly(sympy.numer(temp)).all_coeffs(), float))
+    np.testing.assert_allclose(
+        den, np.asarray(sympy.Poly(sympy.denom(temp)).all_coeffs(), float))
+
+
+def test_num_den_reduced_order(tf):
+    """Check that vanishing leading coefficients are removed."""
+    num, den = tf.num_den({'T1': 0.0, 'T2': -3.0})
+
+    np.testing.assert_equal(num, [1.0])
+    np.testing.assert_equal(den, [-3.0, 1.0])
+
+
+def test_coefficients_vectorized(tf):
+    """Check that coefficients are evaluated for arrays of parameters."""
+    num, den = tf.coefficients([np.array([2.0, 1.0]), np.array([-3.0, 4.0])])
+
+    np.testing.assert_equal(num, [[2.0, 1.0], [1.0, 1.0]])
+    np.testing.assert_equal(den, [[-3.0, 4.0], [1.0, 1.0]])
+
+
+def test_batch_time_response(tf, data_vec):
+    """Check the batched response against the single responses."""
+    param_matrix = np.array([[2.0, -3.0], [1.0, 0.5], [0.0, 0.0]])
+
+    y_batch = tf.batch_time_response(param_matrix, data_vec.x, data_vec.t)
+
+    for parameters, y in zip(param_matrix, y_batch):
+        np.testing.assert_allclose(
+            y, tf.time_response(parameters, data_vec.x, data_vec.t))
+
+
+def test_batch_time_response_long():
+    """Check that the states are not stored for every sample."""
+    s, T1, T2, T3 = sympy.symbols('s T1 T2 T3')
+    tf = systems.Tf((1+s*T1)/((1+s*T2)*(1+s*T3)))
+    t = np.arange(0, 100, 0.05)
+    x = np.sin(t)
+    param_matrix = np.array([[2.0, 3.0, 0.5], [1.0, 0.5, 4.0]])
+
+    y_batch = tf.batch_time_response(param_matrix, x, t)
+
+    for parameters, y in zip(param_matrix, y_batch):
+        num, den = tf.num_den(parameters)
+        _, y_ref, _ = control.forced_response(control.tf(num, den), t, x)
+        np.testing.assert_allclose(y, y_ref, atol=1e-9)
+    assert tf._local.work.size < len(t)
+
+
+@pytest.mark.parametrize('method, atol', [('foh', 1e-9),
+                                          ('zoh', 1e-2),
+                                          ('tustin', 1e-3)])
+def test_discrete_time_response(method, atol):
+    """Check the discrete simulation against forced_response."""
+    s, T1, T2 = sympy.symbols('s T1 T2')
+    expr = (1+s*T1)/(1+s*T2)
+    t = np.arange(0, 10, 0.05)
+    x = np.sin(t) + 1
+    parameters = {'T1': 2.0, 'T2': 3.0}
+
+    y_ref = systems.Tf(expr).time_response(parameters, x, t)
+    tf = systems.Tf(expr, method)
+
+    np.testing.assert_allclose(
+        tf.time_response(parameters, x, t), y_ref, atol=atol)
+    np.testing.assert_allclose(
+        tf.batch_time_response([[2.0, 3.0]], x, t)[0],
+        tf.time_response(parameters, x, t))
+
+
+def test_discretization_error():
+    """Test that unknown discretization methods are rejected."""
+    s, T1 = sympy.symbols('s T1')
+    with pytest.raises(ValueError):
+        systems.Tf(1/(1+s*T1), 'euler')
+
+
+def test_sensitivity_response(tf, data_vec):
+    """Check the sensitivities against finite differences."""
+    t = np.arange(0, 10, 0.1)
+    x = np.sin(t) + 1
+    parameters = np.array([2.0, 3.0])
+
+    y, dy = tf.sensitivity_response(parameters, x, t)
+
+    np.testing.assert_allclose(y, tf.time_response(parameters, x, t))
+    for idx in range(tf.n_atoms):
+        step = np.zeros(tf.n_atoms)
+        step[idx] = 1e-6
+        diff = (tf.time_response(parameters + step, x, t) -
+                tf.time_response(parameters - step, x, t))/2e-6
+        np.testing.assert_allclose(dy[:, idx], diff, atol=1e-6)
+
+
+def test_compilation_cache(monkeypatch, tmpdir):
+    """Check that a compiled system is reused until the version changes."""
+    monkeypatch.setenv('PYPIW_CACHE_DIR', str(tmpdir))
+    s, K, T1, T2 = sympy.symbols('s K T1 T2')
+    expr = K*(1+s*T1)/(1+s*T2)
+    compiled = systems.Tf(expr)
+
+    def expand(self):
+        raise AssertionError("The system was expanded again")
+    monkeypatch.setattr(systems.Tf, '_expand', expand)
+    cached = systems.Tf(expr)
+
+    assert cached.atoms_list == compiled.atoms_list
+    for computed, expected in zip(cached.coefficients([2.0, 1.0, 3.0]),
+                                  compiled.coefficients([2.0, 1.0, 3.0])):
+        np.testing.assert_allclose(computed, expected)
+    np.testing.assert_allclose(cached.coefficient_gradients([2.0, 1.0, 3.0]),
+                               compiled.coefficient_gradients([2.0, 1.0, 3.0]))
+    assert pickle.loads(pickle.dumps(cached)).num_den([2.0, 1.0, 3.0])
+
+    monkeypatch.setattr(pypiw, '__version__', 'other')
+    with pytest.raises(AssertionError):
+        systems.Tf(expr)
+
+
+def test_state_space_feedback():
+    """Check a block diagram against the multiplied out transfer function."""
+    s, K, K2, T1, T2, T3 = sympy.symbols('s K K2 T1 T2 T3')
+    forward, lag = K*(1+s*T3)/(1+s*T1), 1/(1+s*T2)
+    closed = systems.StateSpace.from_tf(forward).series(lag).feedback(K2)
+    tf = systems.Tf(sympy.cancel(forward*lag/(1+forward*lag*K2)))
+    t = np.arange(0, 20, 0.05)
+    x = np.sin(t) + (t > 3)
+    parameters = [[2.0, 0.5, 1.0, 3.0, 0.5], [1.0, 2.0, 2.0, 1.0, 0.1]]
+
+    assert closed.atoms_list == tf.atoms_list
+    assert closed.n_states == 2
+    np.testing.assert_allclose(closed.batch_time_response(parameters, x, t),
+                               tf.batch_time_response(parameters, x, t),
+                               atol=1e-10)
+
+
+def test_state_space_algebraic_loop():
+    """Check positive feedback around a block with feedthrough."""
+    s, K, T1, T3 = sympy.symbols('s K T1 T3')
+    forward = (1+s*T3)/(1+s*T1)
+    closed = systems.StateSpace.from_tf(forward).feedback(K, sign=1)
+    tf = systems.Tf(sympy.cancel(forward/(1-forward*K)))
+    t = np.arange(0, 10, 0.05)
+    parameters = {'K': 0.2, 'T1': 2.0, 'T3': 0.5}
+
+    np.testing.assert_allclose(
+        closed.time_response(parameters, np.ones(len(t)), t),
+        tf.time_response(parameters, np.ones(len(t)), t), atol=1e-10)
+
+
+def test_state_space_pickle():
+    """Check that a pickled state space system simulates the same."""
+    s, T1, T2 = sympy.symbols('s T1 T2')
+    sys = systems.StateSpace.from_tf(1/(1+s*T1)).series(1/(1+s*T2))
+    t = np.arange(0, 5, 0.1)
+    y = sys.time_response([1.0, 2.0], np.ones(len(t)), t)
+
+    np.testing.assert_allclose(
+        pickle.loads(pickle.dumps(sys)).time_response(
+            [1.0, 2.0], np.ones(len(t)), t), y)